@@ -0,0 +1,493 @@
+"""
+Offline benchmark for the GammaWhisper transcription server.
+
+Drives the Flask app in-process (default) or a running server over
+localhost with synthetic speech-like audio of fixed lengths and/or
+recorded files, and reports per model file, device and precision:
+
+- cold start: first /transcribe after all models are unloaded
+- warm p50/p95 latency and real-time factor per audio length
+- word error rate of each non-fp32 precision against the fp32 transcript
+  of the same clip (meaningful with --audio; synthetic clips have no words)
+- peak RSS of the server process while each model is exercised
+- /format_text latency against a local Ollama stand-in with controlled
+  latency (no Ollama install needed)
+
+Results are written as JSON for comparing runs. Runs on a CPU-only box.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --models tiny.en.pt --lengths 2 15 --repeat 5
+    python benchmark.py --precisions fp32 int8 --audio sample.wav
+    python benchmark.py --audio sample.wav --out results/today.json
+    python benchmark.py --url http://127.0.0.1:5000 --server-pid 1234
+
+In --url mode the server must have been started with OLLAMA_HOST pointing
+at the stand-in (default 127.0.0.1:11500) for the formatting benchmark.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import psutil
+import requests
+
+SAMPLE_RATE = 16000
+DEFAULT_LENGTHS = [2, 15, 60, 300]
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, "flask_gui", "models")
+
+
+# ===================================================================
+# Audio
+# ===================================================================
+def synthetic_speech(seconds, seed=0):
+    """
+    Deterministic speech-like signal: bursts of harmonic "syllables" with
+    a moving pitch, grouped into words and separated by pauses, over a
+    low noise floor. It is not intelligible, but it has speech-like energy
+    so VAD and decoding behave as they would on a real recording.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    out = (rng.standard_normal(n) * 0.002).astype(np.float32)
+
+    pos = int(0.3 * SAMPLE_RATE)
+    while pos < n:
+        for _ in range(rng.integers(1, 4)):                     # syllables per word
+            length = int(rng.uniform(0.12, 0.3) * SAMPLE_RATE)
+            end = min(pos + length, n)
+            t = np.arange(end - pos) / SAMPLE_RATE
+            f0 = rng.uniform(100, 220) * (1 + 0.1 * t / max(t[-1], 1e-3)) if len(t) else 0
+            burst = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+            burst *= np.hanning(len(t)) * rng.uniform(0.05, 0.2)
+            out[pos:end] += burst.astype(np.float32)
+            pos = end
+        pos += int(rng.uniform(0.15, 0.8) * SAMPLE_RATE)        # pause between words
+
+    return out
+
+
+def load_recording(path):
+    import whisper
+    return whisper.load_audio(path)
+
+
+def dither(audio, seed):
+    """Tiny per-run noise so repeated runs never hit a result cache."""
+    rng = np.random.default_rng(seed)
+    return audio + (rng.standard_normal(len(audio)) * 1e-5).astype(np.float32)
+
+
+# ===================================================================
+# Ollama Stand-in
+# ===================================================================
+class OllamaStandIn:
+    """
+    Minimal local server speaking Ollama's /api/chat (streaming and not).
+    The reply echoes the user message; first_token_delay and token_delay
+    control how slow the "LLM" is. With disconnect_after, a streaming
+    reply drops the connection after that many pieces. Port 0 picks a
+    free port.
+    """
+
+    def __init__(self, port, first_token_delay=0.2, token_delay=0.01, disconnect_after=None):
+        stand_in = self
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.disconnect_after = disconnect_after
+        self.requests = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                stand_in.requests += 1
+                messages = body.get("messages") or []
+                words = (messages[-1]["content"] if messages else "").split()
+
+                time.sleep(stand_in.first_token_delay)
+
+                if not body.get("stream", True):
+                    time.sleep(stand_in.token_delay * len(words))
+                    self._send_json({
+                        "model": body.get("model"),
+                        "message": {"role": "assistant", "content": " ".join(words)},
+                        "done": True,
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    if i == stand_in.disconnect_after:
+                        self.close_connection = True
+                        return
+                    piece = word if i == 0 else " " + word
+                    self._send_chunk({"message": {"role": "assistant", "content": piece}, "done": False})
+                    time.sleep(stand_in.token_delay)
+                self._send_chunk({"message": {"role": "assistant", "content": ""}, "done": True})
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _send_json(self, obj):
+                data = json.dumps(obj).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, obj):
+                line = json.dumps(obj).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+# ===================================================================
+# Server Clients
+# ===================================================================
+class InProcessClient:
+    def __init__(self):
+        sys.path.insert(0, BASE_DIR)
+        from flask_gui import server
+        self.server = server
+        self.client = server.app.test_client()
+        self.pid = os.getpid()
+
+    def get(self, path):
+        r = self.client.get(path)
+        return r.status_code, r.get_json(silent=True)
+
+    def post(self, path, json=None, data=None, params=None):
+        r = self.client.post(
+            path, json=json, data=data, query_string=params,
+            content_type=None if data is None else "application/octet-stream",
+        )
+        return r.status_code, r.get_json(silent=True)
+
+    def first_chunk(self, path, json=None):
+        r = self.client.post(path, json=json, buffered=False)
+        chunks = iter(r.response)
+        next(chunks, b"")
+        t = time.perf_counter()
+        for _ in chunks:
+            pass
+        r.close()
+        return t
+
+    def set_ollama_url(self, url):
+        self.server.OLLAMA_URL = url
+
+
+class HttpClient:
+    def __init__(self, url, pid=None):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        self.pid = pid
+
+    def get(self, path):
+        r = self.session.get(self.url + path)
+        return r.status_code, r.json() if r.content else None
+
+    def post(self, path, json=None, data=None, params=None):
+        headers = {"Content-Type": "application/octet-stream"} if data is not None else None
+        r = self.session.post(self.url + path, json=json, data=data, params=params, headers=headers)
+        try:
+            return r.status_code, r.json()
+        except ValueError:
+            return r.status_code, None
+
+    def first_chunk(self, path, json=None):
+        with self.session.post(self.url + path, json=json, stream=True) as r:
+            chunks = r.iter_content(chunk_size=None)
+            next(chunks, b"")
+            t = time.perf_counter()
+            for _ in chunks:
+                pass
+        return t
+
+    def set_ollama_url(self, url):
+        pass    # fixed by the server's OLLAMA_HOST
+
+
+# ===================================================================
+# Measurement Helpers
+# ===================================================================
+class RssSampler:
+    """Samples a process's RSS in the background and keeps the peak."""
+
+    def __init__(self, pid, interval=0.01):
+        self.proc = psutil.Process(pid) if pid else None
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        if self.proc:
+            self.peak = self.proc.memory_info().rss
+            threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.peak = max(self.peak, self.proc.memory_info().rss)
+            except psutil.Error:
+                return
+
+    def __exit__(self, *exc):
+        self._stop.set()
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / 2**20, 1) if self.proc else None
+
+
+def summarize(latencies, audio_seconds):
+    lat = np.asarray(latencies)
+    p50, p95 = np.percentile(lat, [50, 95])
+    return {
+        "runs": len(lat),
+        "p50_seconds": round(float(p50), 4),
+        "p95_seconds": round(float(p95), 4),
+        "mean_seconds": round(float(lat.mean()), 4),
+        "rtf_p50": round(float(p50) / audio_seconds, 4),
+        "rtf_p95": round(float(p95) / audio_seconds, 4),
+    }
+
+
+def transcribe(client, audio):
+    start = time.perf_counter()
+    status, body = client.post(
+        "/transcribe", data=audio.astype(np.float32).tobytes(),
+        params={"dtype": "float32", "sample_rate": SAMPLE_RATE},
+    )
+    elapsed = time.perf_counter() - start
+    if status != 200:
+        raise RuntimeError(f"/transcribe returned {status}: {body}")
+    return elapsed, body
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref = reference.lower().split()
+    hyp = hypothesis.lower().split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1] / len(ref)
+
+
+# ===================================================================
+# Benchmarks
+# ===================================================================
+def bench_model(client, model, device, precision, clips, repeat, log, reference=None):
+    client.post("/set_device", json={"device": device})
+    client.post("/set_model", json={"model": model})
+    status, body = client.post("/set_precision", json={"precision": precision})
+    if status != 200:
+        raise RuntimeError(f"/set_precision returned {status}: {body}")
+    client.post("/unload")
+
+    result = {"model": model, "device": device, "precision": precision, "clips": []}
+
+    with RssSampler(client.pid) as rss:
+        first_audio = clips[0][1]
+        cold, _ = transcribe(client, dither(first_audio, seed=10_000))
+        result["cold_start_seconds"] = round(cold, 4)
+        log(f"  cold start ({clips[0][0]}): {cold:.2f}s")
+
+        for label, audio in clips:
+            seconds = len(audio) / SAMPLE_RATE
+            _, body = transcribe(client, dither(audio, seed=20_000))      # warm-up for this length
+            text = body.get("text", "")
+
+            latencies = []
+            for i in range(repeat):
+                elapsed, _ = transcribe(client, dither(audio, seed=i))
+                latencies.append(elapsed)
+
+            entry = {"clip": label, "audio_seconds": round(seconds, 2), **summarize(latencies, seconds),
+                     "text": text}
+            wer = ""
+            if reference is not None and label in reference:
+                entry["wer_vs_fp32"] = round(word_error_rate(reference[label], text), 4)
+                wer = f"  WER vs fp32 {entry['wer_vs_fp32']:.3f}"
+            result["clips"].append(entry)
+            log(f"  {label:>12}: p50 {entry['p50_seconds']:.3f}s  p95 {entry['p95_seconds']:.3f}s  "
+                f"RTF {entry['rtf_p50']:.3f}{wer}")
+
+    result["peak_rss_mb"] = rss.peak_mb
+    return result
+
+
+def bench_format(client, stand_in, profile, repeat, log):
+    client.set_ollama_url(stand_in.url)
+    status, _ = client.post("/set_format", json={"format": profile})
+    if status != 200:
+        log(f"  format profile '{profile}' not available, skipping")
+        return None
+
+    text = "so um this is a short dictated sentence that needs some cleanup before pasting"
+
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        client.post("/format_text", json={"text": f"{text} {i}"})     # unique text: no cache hits
+        latencies.append(time.perf_counter() - start)
+
+    first_piece = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        t = client.first_chunk("/format_text", json={"text": f"{text} stream {i}", "stream": True})
+        first_piece.append(t - start)
+
+    client.post("/set_format", json={"format": "disable"})
+
+    lat, ttfb = np.asarray(latencies), np.asarray(first_piece)
+    result = {
+        "profile": profile,
+        "stand_in_first_token_delay": stand_in.first_token_delay,
+        "stand_in_token_delay": stand_in.token_delay,
+        "p50_seconds": round(float(np.percentile(lat, 50)), 4),
+        "p95_seconds": round(float(np.percentile(lat, 95)), 4),
+        "stream_first_piece_p50_seconds": round(float(np.percentile(ttfb, 50)), 4),
+        "stream_first_piece_p95_seconds": round(float(np.percentile(ttfb, 95)), 4),
+    }
+    log(f"  format p50 {result['p50_seconds']:.3f}s  p95 {result['p95_seconds']:.3f}s  "
+        f"stream first piece p50 {result['stream_first_piece_p50_seconds']:.3f}s")
+    return result
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+
+    info = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "total_ram_mb": round(psutil.virtual_memory().total / 2**20),
+    }
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+        info["cuda_available"] = torch.cuda.is_available()
+    except ImportError:
+        pass
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GammaWhisper transcription server.")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--server-pid", type=int, help="server PID for peak RSS in --url mode")
+    parser.add_argument("--models", nargs="+", help="model files (default: all in flask_gui/models)")
+    parser.add_argument("--devices", nargs="+", default=["cpu"])
+    parser.add_argument("--precisions", nargs="+", default=["fp32"], choices=["fp32", "int8"],
+                        help="weight precisions to compare (int8 is CPU only)")
+    parser.add_argument("--lengths", nargs="+", type=float, default=DEFAULT_LENGTHS,
+                        help="synthetic clip lengths in seconds")
+    parser.add_argument("--audio", nargs="*", default=[], help="recorded audio files to include")
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs per clip")
+    parser.add_argument("--no-vad", action="store_true", help="disable the VAD stage while benchmarking")
+    parser.add_argument("--format-profile", default="qwen_small")
+    parser.add_argument("--skip-format", action="store_true")
+    parser.add_argument("--ollama-port", type=int, default=11500)
+    parser.add_argument("--llm-first-token", type=float, default=0.2, help="stand-in delay before the reply")
+    parser.add_argument("--llm-token-delay", type=float, default=0.01, help="stand-in delay per word")
+    parser.add_argument("--out", default=os.path.join(BASE_DIR, "bench_results",
+                                                      time.strftime("bench_%Y%m%d_%H%M%S.json")))
+    args = parser.parse_args()
+
+    def log(msg):
+        print(msg, flush=True)
+
+    stand_in = None
+    if not args.skip_format:
+        stand_in = OllamaStandIn(args.ollama_port, args.llm_first_token, args.llm_token_delay)
+        os.environ.setdefault("OLLAMA_HOST", stand_in.url)
+
+    client = HttpClient(args.url, args.server_pid) if args.url else InProcessClient()
+
+    models = args.models
+    if not models:
+        _, cfg = client.get("/get_config")
+        models = cfg.get("models", [])
+    if not models:
+        log(f"No models found (looked in {MODELS_DIR}).")
+        sys.exit(1)
+
+    clips = [(f"synthetic_{l:g}s", synthetic_speech(l, seed=int(l * 1000))) for l in args.lengths]
+    clips += [(os.path.basename(p), load_recording(p)) for p in args.audio]
+
+    if args.no_vad:
+        client.post("/set_vad", json={"enabled": False})
+
+    results = {"environment": environment_info(), "mode": "http" if args.url else "in-process",
+               "repeat": args.repeat, "vad": not args.no_vad, "models": [], "format": None}
+
+    # fp32 runs first so the other precisions have a reference transcript
+    precisions = sorted(set(args.precisions), key=lambda p: p != "fp32")
+
+    for device in args.devices:
+        for model in models:
+            reference = None
+            for precision in precisions:
+                if precision == "int8" and device != "cpu":
+                    continue
+                log(f"{model} on {device} ({precision})")
+                try:
+                    res = bench_model(client, model, device, precision, clips, args.repeat, log, reference)
+                except Exception as e:
+                    log(f"  failed: {e}")
+                    res = {"model": model, "device": device, "precision": precision, "error": str(e)}
+                results["models"].append(res)
+                if precision == "fp32" and "clips" in res:
+                    reference = {c["clip"]: c["text"] for c in res["clips"]}
+
+    if stand_in is not None:
+        log(f"format_text via stand-in ({stand_in.url})")
+        results["format"] = bench_format(client, stand_in, args.format_profile, max(args.repeat, 5), log)
+        stand_in.close()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    log(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Worker side of the parallel long-form transcription pool (see the
+"Parallel Long-Form Transcription" section in server.py).
+
+This module is deliberately free of Flask and server state: spawned
+workers import only this file, so starting the pool does not re-run the
+server's logging setup or background threads.
+"""
+import torch
+from whisper.model import AudioEncoder, Linear, ModelDimensions, TextDecoder, Whisper
+
+_model = None
+_init_error = None
+
+
+def whisper_skeleton(dims):
+    """Whisper module with its weights on the meta device; mirrors Whisper.__init__ without allocating them."""
+    m = Whisper.__new__(Whisper)
+    torch.nn.Module.__init__(m)
+    m.dims = dims
+    with torch.device("meta"):
+        m.encoder = AudioEncoder(dims.n_mels, dims.n_audio_ctx, dims.n_audio_state, dims.n_audio_head, dims.n_audio_layer)
+        m.decoder = TextDecoder(dims.n_vocab, dims.n_text_ctx, dims.n_text_state, dims.n_text_head, dims.n_text_layer)
+    return m
+
+
+def finish_skeleton(m):
+    """Call after load_state_dict(assign=True): adds the non-persistent buffers __init__ would create."""
+    dims = m.dims
+    m.decoder.register_buffer(
+        "mask", torch.empty(dims.n_text_ctx, dims.n_text_ctx).fill_(float("-inf")).triu_(1), persistent=False
+    )
+    all_heads = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+    all_heads[dims.n_text_layer // 2:] = True
+    m.register_buffer("alignment_heads", all_heads.to_sparse(), persistent=False)
+
+    if any(t.is_meta for t in list(m.parameters()) + list(m.buffers())):
+        raise RuntimeError("model has uninitialized tensors")
+    return m
+
+
+def quantize_int8(m):
+    """Dynamic int8 quantization of every Linear layer; weights int8, activations quantized per call."""
+    # whisper.model.Linear only adds a dtype cast; quantize_dynamic matches exact types
+    for module in m.modules():
+        if isinstance(module, Linear):
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(m, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def build_int8_model(saved):
+    """
+    Model from an int8 cache (dims + quantized state dict, no pickled
+    modules). The skeleton's Linear layers are swapped for empty dynamic
+    quantized ones, which the saved packed weights then fill.
+    """
+    m = whisper_skeleton(ModelDimensions(**saved["dims"]))
+    for parent in list(m.modules()):
+        for name, child in parent.named_children():
+            if isinstance(child, torch.nn.Linear):
+                setattr(parent, name, torch.ao.nn.quantized.dynamic.Linear(
+                    child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8,
+                ))
+    m.load_state_dict(saved["model_state_dict"], assign=True)
+    return finish_skeleton(m)
+
+
+def init_worker(threads, dims, state_dict=None, cache_file=None):
+    """
+    Pool initializer. fp32 workers get the state_dict, whose tensors live
+    in shared memory owned by the server process; assign=True makes the
+    worker's parameters point at those storages instead of copying them.
+    Quantized tensors lose their quantizer when shared between processes,
+    so int8 workers load their own copy from the on-disk int8 cache.
+    """
+    global _model, _init_error
+    torch.set_num_threads(threads)
+
+    # An exception here would make the pool respawn the worker forever;
+    # keep it and fail each segment instead.
+    try:
+        if cache_file is not None:
+            model = build_int8_model(torch.load(cache_file, map_location="cpu", weights_only=True))
+        else:
+            model = Whisper(ModelDimensions(**dims))
+            model.load_state_dict(state_dict, assign=True)
+        model.eval()
+        _model = model
+    except Exception as e:
+        _init_error = f"{type(e).__name__}: {e}"
+
+
+def transcribe_segment(audio, options):
+    if _model is None:
+        raise RuntimeError(f"long-form worker failed to start: {_init_error}")
+    out = _model.transcribe(audio, **options)
+    return (out.get("text") or "").strip()
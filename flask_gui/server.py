@@ -1,15 +1,30 @@
 import os
 import sys
+import io
 import time
 import json
+import re
+import hashlib
+import atexit
 import logging
+import contextvars
 import threading
 import gc
-import torch
-from flask import Flask, request, jsonify, render_template
-import whisper
+import heapq
+import itertools
+import asyncio
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import numpy as np
+import psutil
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
 import requests as http_client
 import subprocess
+import uuid
+import queue
+import sqlite3
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # -------------------------------------------------------------------
 # Path Helpers for PyInstaller build
@@ -19,26 +34,73 @@ def resource_path(relative):
         return os.path.join(sys._MEIPASS, relative)
     return os.path.join(os.path.dirname(__file__), relative)
 
+# Logs, caches and the transcript history go under WHISPER_DATA_DIR when it
+# is set (the tests point it at a temp dir), next to the app otherwise.
+DATA_DIR = os.environ.get("WHISPER_DATA_DIR")
+
+def data_path(relative):
+    if DATA_DIR:
+        return os.path.join(DATA_DIR, relative)
+    return resource_path(relative)
+
 # -------------------------------------------------------------------
 # LOGGING SETUP
 # -------------------------------------------------------------------
-LOG_DIR = resource_path("logs")
+# Log calls only put the record on a queue; a QueueListener thread does
+# the formatting and the disk writes. server.log is appended to and
+# rotated by size, so earlier sessions are kept. Every record carries the
+# trace ID of the request it belongs to (the client's X-Trace-Id, see
+# run.py), which lines a dictation up across run.log and server.log.
+LOG_DIR = data_path("logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 
 server_log_path = os.path.join(LOG_DIR, "server.log")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_JSON = False          # JSON lines instead of plain text
+
+trace_id_var = contextvars.ContextVar("trace_id", default="-")
+
+class TraceIdFilter(logging.Filter):
+    """Stamps the current trace ID; runs in the caller's thread, before the queue."""
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }, ensure_ascii=False)
 
 logger = logging.getLogger("server")
 logger.setLevel(logging.INFO)
 
-handler = logging.FileHandler(server_log_path, mode="w", encoding="utf-8")
-formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+handler = RotatingFileHandler(
+    server_log_path, mode="a", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8",
+)
+if LOG_JSON:
+    formatter = JsonLineFormatter()
+else:
+    formatter = logging.Formatter("%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s")
 handler.setFormatter(formatter)
 
 if logger.handlers:
     logger.handlers.clear()
 
-logger.addHandler(handler)
-logger.info("Server started fresh (log overwritten).")
+log_queue = queue.SimpleQueue()
+queue_handler = QueueHandler(log_queue)
+queue_handler.addFilter(TraceIdFilter())
+logger.addHandler(queue_handler)
+
+log_listener = QueueListener(log_queue, handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+logger.info("Server started.")
 
 # -------------------------------------------------------------------
 # HIDE FFMPEG CONSOLE WINDOW
@@ -63,9 +125,114 @@ app = Flask(
     static_folder=resource_path("static"),
 )
 
-TRANSCRIPTS_DIR = resource_path("transcripts")
+TRANSCRIPTS_DIR = data_path("transcripts")
 os.makedirs(TRANSCRIPTS_DIR, exist_ok=True)
 
+SERVER_STARTED = time.time()
+
+# -------------------------------------------------------------------
+# Metrics (Prometheus text format, served on /metrics)
+# -------------------------------------------------------------------
+# Counters and histograms are kept in-process; gauges are collected from
+# callbacks at scrape time. Everything is prefixed with "gammawhisper_".
+METRICS_PREFIX = "gammawhisper_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RTF_BUCKETS = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5)
+
+METRIC_HELP = {
+    "stage_seconds": "Latency of each request stage in seconds.",
+    "request_seconds": "Wall time spent in each route handler in seconds.",
+    "requests_total": "HTTP requests by route and status code.",
+    "real_time_factor": "Inference seconds per second of audio, by model and device.",
+    "model_load_seconds": "Time taken to load a Whisper model in seconds.",
+    "model_loads_total": "Whisper model loads.",
+    "model_unloads_total": "Whisper models dropped from memory, by reason.",
+    "model_restores_total": "Offloaded CUDA models moved back to the GPU on use.",
+    "eviction_decisions_total": "Eviction policy decisions, by action and reason.",
+    "async_rejected_total": "Requests turned away by the async server's limits, by reason.",
+    "format_route_total": "Formatting requests finished by local rules or escalated to the LLM.",
+    "llm_residency_total": "Ollama model loads and unloads requested on profile changes.",
+    "history_writes_total": "Transcripts written to the history store.",
+    "history_removed_total": "History entries removed by retention limits.",
+    "audio_seconds_total": "Seconds of audio received for transcription.",
+    "vad_removed_seconds_total": "Seconds of silence removed by VAD before inference.",
+}
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> [buckets, bucket counts, sum, count]
+        self.gauge_sources = []
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[1][i] += 1
+            h[2] += value
+            h[3] += 1
+
+    def gauges(self, fn):
+        """Registers fn() -> [(name, help, labels dict, value)], called at scrape time."""
+        self.gauge_sources.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        seen = set()
+
+        def header(name, kind, help_text=None):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {METRICS_PREFIX}{name} {help_text or METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda kv: kv[0])
+            histograms = [(k, (h[0], list(h[1]), h[2], h[3])) for k, h in histograms]
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{METRICS_PREFIX}{name}{_label_str(labels)} {value}")
+
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            header(name, "histogram")
+            for bound, n in zip(buckets, counts):
+                lines.append(f"{METRICS_PREFIX}{name}_bucket{_label_str(labels + (('le', bound),))} {n}")
+            lines.append(f"{METRICS_PREFIX}{name}_bucket{_label_str(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{METRICS_PREFIX}{name}_sum{_label_str(labels)} {total}")
+            lines.append(f"{METRICS_PREFIX}{name}_count{_label_str(labels)} {count}")
+
+        for source in self.gauge_sources:
+            try:
+                for name, help_text, labels, value in source():
+                    header(name, "gauge", help_text)
+                    lines.append(f"{METRICS_PREFIX}{name}{_label_str(tuple(sorted(labels.items())))} {value}")
+            except Exception as e:
+                logger.error(f"Metrics gauge collection failed: {e}", exc_info=True)
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
 # -------------------------------------------------------------------
 # Whisper Model State
 # -------------------------------------------------------------------
@@ -73,103 +240,1514 @@ device = "cpu"
 model_name = "tiny.en.pt"
 model_path = resource_path(os.path.join("models", model_name))
 USE_FP16 = False
-model = None
+model_precision = "fp32"  # precision of the resident weights (USE_FP16 only affects decoding)
+MODEL_PRECISIONS = ("fp32", "int8")  # int8 = dynamically quantized Linear layers, CPU only
+
+# torch and whisper take seconds to import, so the server starts without
+# them and imports them on first use (model load, warm-up, or an upload
+# that needs ffmpeg). Anything that touches torch or whisper outside the
+# model load path calls import_inference_libs() first.
+torch = None
+whisper = None
+long_form_worker = None
+inference_libs_ready = False
+inference_libs_lock = threading.Lock()
+
+def import_inference_libs():
+    global torch, whisper, long_form_worker, inference_libs_ready
+    if inference_libs_ready:
+        return
+
+    with inference_libs_lock:
+        if inference_libs_ready:
+            return
+
+        start = time.time()
+        import torch
+        import torch.multiprocessing
+        import whisper
+        try:
+            from flask_gui import long_form_worker
+        except ImportError:
+            import long_form_worker
+        instrument_mel_stage()
+
+        inference_libs_ready = True
+        logger.info(f"Imported torch {torch.__version__} and whisper in {time.time() - start:.2f}s")
 
-# Idle unload system
-IDLE_TIMEOUT = 300        # 5 minutes
+# Last inference time; also refreshes the model's eviction clock
 last_model_use = time.time()
 
 def update_idle_timer():
     global last_model_use
     last_model_use = time.time()
+    entry = model_cache.get(current_model_key())
+    if entry is not None:
+        entry["last_used"] = last_model_use
+
+# -------------------------------------------------------------------
+# Decoding Profiles
+# -------------------------------------------------------------------
+# Named presets for whisper's decoding knobs, selected with /set_decode.
+# "balanced" is whisper's own transcribe() defaults. "fast" decodes each
+# window once, greedily, without timestamp tokens or the previous window's
+# text as a prompt, so nothing is re-decoded. "accurate" adds beam search
+# and best-of sampling on top of the fallback ladder.
+#   beam_size / best_of   - beams at temperature 0 / samples when falling back
+#   temperature           - fallback schedule, tried until a window passes
+#                           the compression and logprob thresholds
+#   no_speech_threshold   - windows above it (with low logprob) count as silence
+#   without_timestamps    - skip timestamp tokens (windows then advance 30 s)
+FALLBACK_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+DECODE_PROFILES = {
+    "fast": {
+        "beam_size": None,
+        "best_of": None,
+        "temperature": (0.0,),
+        "compression_ratio_threshold": 2.4,
+        "logprob_threshold": -1.0,
+        "no_speech_threshold": 0.6,
+        "condition_on_previous_text": False,
+        "without_timestamps": True,
+    },
+    "balanced": {
+        "beam_size": None,
+        "best_of": None,
+        "temperature": FALLBACK_TEMPERATURES,
+        "compression_ratio_threshold": 2.4,
+        "logprob_threshold": -1.0,
+        "no_speech_threshold": 0.6,
+        "condition_on_previous_text": True,
+        "without_timestamps": False,
+    },
+    "accurate": {
+        "beam_size": 5,
+        "best_of": 5,
+        "temperature": FALLBACK_TEMPERATURES,
+        "compression_ratio_threshold": 2.4,
+        "logprob_threshold": -1.0,
+        "no_speech_threshold": 0.6,
+        "condition_on_previous_text": True,
+        "without_timestamps": False,
+    },
+}
+decode_mode = "balanced"
+
+def decode_options():
+    """Keyword arguments for whisper's transcribe() from the active profile."""
+    return dict(DECODE_PROFILES[decode_mode])
+
+# -------------------------------------------------------------------
+# Raw PCM Audio Input
+# -------------------------------------------------------------------
+# Clients can POST raw PCM bytes (application/octet-stream) to /transcribe
+# instead of a WAV upload. The samples are decoded straight into a NumPy
+# array and handed to Whisper, skipping temp files and the ffmpeg decode.
+SAMPLE_RATE = 16000                       # the only rate Whisper accepts (whisper.audio.SAMPLE_RATE)
+WINDOW_SAMPLES = 30 * SAMPLE_RATE         # one Whisper window (whisper.audio.N_SAMPLES)
+PCM_DTYPES = {"float32": np.float32, "int16": np.int16}
+
+def decode_pcm(raw, dtype="float32", sample_rate=SAMPLE_RATE):
+    if dtype not in PCM_DTYPES:
+        raise ValueError(f"Unsupported PCM dtype: {dtype}")
+
+    if int(sample_rate) != SAMPLE_RATE:
+        raise ValueError(f"Unsupported sample rate: {sample_rate} (expected {SAMPLE_RATE})")
+
+    np_dtype = PCM_DTYPES[dtype]
+    if len(raw) % np.dtype(np_dtype).itemsize:
+        raise ValueError(f"PCM payload length {len(raw)} is not a multiple of {dtype} size")
+
+    # astype() copies, so the array is writable for torch.from_numpy
+    audio = np.frombuffer(raw, dtype=np_dtype).astype(np.float32)
+    if np_dtype is np.int16:
+        audio /= 32768.0
+    return audio
+
+class AudioDecodeError(ValueError):
+    """ffmpeg could not decode the upload (corrupt or not audio)."""
+
+def is_raw_pcm_upload(storage):
+    """
+    Only parts that say they are raw PCM skip ffmpeg: a .pcm filename or an
+    explicit dtype/sample_rate query. application/octet-stream alone is not
+    enough (curl and requests send WAV parts with it), and a RIFF/WAVE
+    header always means a container for ffmpeg.
+    """
+    head = storage.stream.read(12)
+    storage.stream.seek(0)
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return False
+    return (
+        (storage.filename or "").endswith(".pcm")
+        or "dtype" in request.args
+        or "sample_rate" in request.args
+    )
+
+def load_uploaded_file(storage):
+    """Decodes a multipart upload: raw PCM parts in memory, anything else via ffmpeg."""
+    if is_raw_pcm_upload(storage):
+        return decode_pcm(
+            storage.read(),
+            dtype=request.args.get("dtype", "float32"),
+            sample_rate=request.args.get("sample_rate", SAMPLE_RATE),
+        )
+
+    import_inference_libs()
+    temp_path = os.path.join(TRANSCRIPTS_DIR, f"temp_{uuid.uuid4().hex}.wav")
+    storage.save(temp_path)
+    try:
+        return whisper.load_audio(temp_path)
+    except RuntimeError as e:
+        # whisper.load_audio raises RuntimeError when ffmpeg rejects the
+        # input; a missing ffmpeg binary is an OSError and stays a 500
+        raise AudioDecodeError(f"Could not decode audio: {e}") from e
+    finally:
+        try:
+            os.remove(temp_path)
+        except:
+            pass
+
+def read_request_audio(timings=None):
+    """
+    Returns the request audio as a float32 mono array at SAMPLE_RATE.
+    Raw PCM bodies are decoded in memory; legacy multipart WAV uploads
+    still go through a temp file and ffmpeg. If a timings dict is given,
+    "receive" and "decode" seconds are recorded in it.
+    """
+    timings = {} if timings is None else timings
+    start = time.time()
+
+    if "file" in request.files:
+        audio = load_uploaded_file(request.files["file"])
+        timings["receive"] = 0.0
+        timings["decode"] = time.time() - start
+    else:
+        raw = request.get_data(cache=False)
+        if not raw:
+            raise ValueError("Missing audio: send raw PCM bytes or a multipart 'file'")
+        received = time.time()
+
+        audio = decode_pcm(
+            raw,
+            dtype=request.args.get("dtype", "float32"),
+            sample_rate=request.args.get("sample_rate", SAMPLE_RATE),
+        )
+        timings["receive"] = received - start
+        timings["decode"] = time.time() - received
+
+    metrics.observe("stage_seconds", timings["receive"], stage="upload_receive")
+    metrics.observe("stage_seconds", timings["decode"], stage="audio_decode")
+    metrics.inc("audio_seconds_total", len(audio) / SAMPLE_RATE)
+    return audio
+
+def audio_error_response(e, context):
+    """JSON reply for a failed read_request_audio(): 400 for bad input, 500 otherwise."""
+    if isinstance(e, ValueError):
+        logger.warning(f"Bad audio in {context}: {e}")
+        return jsonify({"error": str(e)}), 400
+    logger.error(f"Reading audio for {context} failed: {e}", exc_info=True)
+    return jsonify({"error": str(e)}), 500
+
+# -------------------------------------------------------------------
+# Voice Activity Detection
+# -------------------------------------------------------------------
+# Energy-based VAD in front of Whisper. Frames are classified against an
+# adaptive threshold (noise floor + margin, capped below the loudest frames
+# so recordings without pauses keep their speech), short blips are dropped,
+# regions are padded and the speech is stitched back together with a short
+# gap. Recordings with no speech never reach the model.
+VAD_ENABLED = True
+VAD_FRAME_MS = 30
+VAD_SPEECH_PEAK_DB = -45     # recordings with under VAD_MIN_SPEECH_MS above this are silent
+VAD_FLOOR_DB = -55           # frames below this are never speech
+VAD_MARGIN_DB = 12           # speech must be this far above the noise floor...
+VAD_DYNAMIC_DB = 10          # ...or at least within this of the loud frames
+VAD_MIN_SPEECH_MS = 120      # shorter bursts (clicks, bumps) are ignored
+VAD_PAD_MS = 200             # context kept on each side of a speech region
+VAD_GAP_MS = 100             # silence inserted between stitched regions
+
+def detect_speech(audio):
+    """Returns a list of (start, end) sample ranges containing speech."""
+    frame = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    frames = frames - frames.mean(axis=1, keepdims=True)
+    energy = np.einsum("ij,ij->i", frames, frames) / frame
+    db = 10.0 * np.log10(energy + 1e-10)
+
+    # A short "yes" in a long silence is only a few percent of the frames,
+    # so the gate counts loud frames; the percentiles only shape the threshold
+    if np.count_nonzero(db > VAD_SPEECH_PEAK_DB) * VAD_FRAME_MS < VAD_MIN_SPEECH_MS:
+        return []
+
+    floor, peak = np.percentile(db, [10, 95])
+
+    threshold = max(VAD_FLOOR_DB, min(floor + VAD_MARGIN_DB, peak - VAD_DYNAMIC_DB))
+    speech = np.concatenate(([False], db > threshold, [False]))
+
+    # Drop bursts shorter than VAD_MIN_SPEECH_MS
+    edges = np.flatnonzero(np.diff(speech.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    keep = (ends - starts) * VAD_FRAME_MS >= VAD_MIN_SPEECH_MS
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return []
+
+    # Pad each region and merge the ones that now overlap
+    pad = VAD_PAD_MS // VAD_FRAME_MS
+    starts = np.maximum(starts - pad, 0)
+    ends = np.minimum(ends + pad, n_frames)
+    new_region = np.concatenate(([True], starts[1:] > ends[:-1]))
+    region_starts = starts[new_region]
+    region_ends = np.maximum.reduceat(ends, np.flatnonzero(new_region))
+
+    regions = [(int(s) * frame, int(e) * frame) for s, e in zip(region_starts, region_ends)]
+    # The tail shorter than one frame belongs to a region that reaches the end
+    if regions[-1][1] == n_frames * frame:
+        regions[-1] = (regions[-1][0], len(audio))
+    return regions
+
+def trim_silence(audio):
+    """Returns (speech_only_audio, seconds_removed)."""
+    regions = detect_speech(audio)
+    if not regions:
+        return np.zeros(0, dtype=np.float32), len(audio) / SAMPLE_RATE
+
+    gap = np.zeros(SAMPLE_RATE * VAD_GAP_MS // 1000, dtype=np.float32)
+    pieces = []
+    for start, end in regions:
+        if pieces:
+            pieces.append(gap)
+        pieces.append(audio[start:end])
+
+    trimmed = pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+    return trimmed, max(0.0, (len(audio) - len(trimmed)) / SAMPLE_RATE)
+
+# -------------------------------------------------------------------
+# LRU Result Cache
+# -------------------------------------------------------------------
+# Small in-memory LRU with size and TTL eviction. Persistent caches are
+# written to CACHE_DIR as JSON every CACHE_FLUSH_INTERVAL seconds when
+# dirty and again at exit, so they survive restarts.
+CACHE_DIR = data_path("cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+CACHE_FLUSH_INTERVAL = 30
+
+persistent_caches = []
+
+def content_key(*parts):
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+class LRUCache:
+    def __init__(self, name, max_entries, ttl=None, persist=False):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = os.path.join(CACHE_DIR, f"{name}.json") if persist else None
+        self.data = OrderedDict()   # key -> (expires_at or None, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+        if self.path:
+            self.load()
+            persistent_caches.append(self)
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and item[0] is not None and item[0] < time.time():
+                del self.data[key]
+                self.dirty = True
+                item = None
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+            self.dirty = True
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.dirty = True
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.data),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Failed to load {self.name} cache: {e}", exc_info=True)
+            return
+
+        now = time.time()
+        with self.lock:
+            for key, expires, value in items[-self.max_entries:]:
+                if expires is None or expires > now:
+                    self.data[key] = (expires, value)
+        logger.info(f"Loaded {len(self.data)} {self.name} cache entries.")
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            items = [[k, e, v] for k, (e, v) in self.data.items()]
+            self.dirty = False
+
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.error(f"Failed to save {self.name} cache: {e}", exc_info=True)
+
+def flush_caches():
+    for cache in persistent_caches:
+        cache.save()
+
+def cache_flusher():
+    while True:
+        time.sleep(CACHE_FLUSH_INTERVAL)
+        flush_caches()
+
+threading.Thread(target=cache_flusher, daemon=True).start()
+atexit.register(flush_caches)
+
+# -------------------------------------------------------------------
+# Local Formatter
+# -------------------------------------------------------------------
+# A profile with "rules" is cleaned up locally with precompiled regexes:
+# filler words are dropped, a replacement dictionary is applied, and
+# capitalization and punctuation are fixed. The LLM is only called when
+# the profile has a model and the "escalate" heuristic asks for it (long
+# dictations, repeated words, self-corrections), so short utterances
+# never reach Ollama.
+DEFAULT_FILLERS = ["um", "umm", "uh", "uhh", "erm", "er", "ah", "hmm", "mhm"]
+DEFAULT_CORRECTION_MARKERS = ["scratch that", "no wait", "i mean", "sorry i meant", "let me rephrase"]
+DEFAULT_ESCALATE_MIN_WORDS = 40
+DEFAULT_ESCALATE_MAX_DISFLUENCIES = 0
+
+SPACE_BEFORE_PUNCT = re.compile(r"\s+([,.;:!?])")
+REPEATED_PUNCT = re.compile(r"([,;:])(?:\s*[,;:])+|([.!?])\2+")
+LEADING_PUNCT = re.compile(r"^[\s,;:.]+")
+COMMA_BEFORE_STOP = re.compile(r",\s*([.!?])")
+# Only "," and ";": a "." or ":" or "?" followed by a letter is usually a
+# file name, URL or abbreviation (server.py, acme.com, i.e., page?id=3)
+MISSING_SPACE_AFTER = re.compile(r"([,;])(?=[^\W\d_])")
+MULTI_SPACE = re.compile(r"[ \t]+")
+SENTENCE_START = re.compile(r"(^|[.!?]\s+|\n\s*)([a-z])")
+# A period that ends one of these does not end the sentence
+ABBREVIATION_END = re.compile(r"\b(?:(?:[a-z]\.){2,}|(?:etc|vs|cf|approx|mr|mrs|ms|dr|st)\.)$", re.IGNORECASE)
+LOWER_I = re.compile(r"\bi\b(?!\.\w)(?=(?:'(?:m|ve|ll|d))?\b)")
+REPEATED_WORD = re.compile(r"\b(\w+)(?:[\s,-]+\1\b)+", re.IGNORECASE)
+WORD = re.compile(r"\S+")
+
+def phrase_pattern(phrases, flags=re.IGNORECASE):
+    """Whole-word alternation (case-insensitive by default), longest phrase first."""
+    alternatives = sorted((re.escape(p.strip()) for p in phrases if p.strip()), key=len, reverse=True)
+    if not alternatives:
+        return None
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", flags)
+
+def filler_pattern(fillers):
+    """
+    Fillers match in lowercase or capitalized ("um", "Um") only: an all-caps
+    "ER" or "AH" is an abbreviation, not a hesitation.
+    """
+    forms = []
+    for filler in fillers:
+        word = filler.strip().lower()
+        forms += [word, word[:1].upper() + word[1:]]
+    return phrase_pattern(forms, flags=0)
+
+def compile_rules(name, raw):
+    """
+    Validates a profile's "rules" into regexes. true or {} means all
+    defaults; false means no rules (returns None).
+    """
+    if raw is False:
+        return None
+    if raw is True:
+        raw = {}
+    if not isinstance(raw, dict):
+        raise ValueError(f"profile {name!r}: rules must be true, false or an object")
+
+    fillers = raw.get("fillers", DEFAULT_FILLERS)
+    replacements = raw.get("replacements", {})
+    if not isinstance(fillers, list) or not all(isinstance(f, str) for f in fillers):
+        raise ValueError(f"profile {name!r}: rules.fillers must be a list of strings")
+    if not isinstance(replacements, dict) or not all(isinstance(v, str) for v in replacements.values()):
+        raise ValueError(f"profile {name!r}: rules.replacements must map strings to strings")
+
+    filler_words = filler_pattern(fillers)
+    return {
+        # A filler takes its trailing comma with it: "um, so" -> "so"
+        "fillers": re.compile(filler_words.pattern + r"[,]?\s*") if filler_words else None,
+        "replacements": phrase_pattern(replacements),
+        "replacement_map": {k.strip().lower(): v for k, v in replacements.items()},
+        "capitalize": bool(raw.get("capitalize", True)),
+        "punctuate": bool(raw.get("punctuate", True)),
+    }
+
+def compile_escalation(name, raw):
+    if not isinstance(raw, dict):
+        raise ValueError(f"profile {name!r}: escalate must be an object")
+    min_words = raw.get("min_words", DEFAULT_ESCALATE_MIN_WORDS)
+    max_disfluencies = raw.get("max_disfluencies", DEFAULT_ESCALATE_MAX_DISFLUENCIES)
+    markers = raw.get("markers", DEFAULT_CORRECTION_MARKERS)
+    for field, value in (("min_words", min_words), ("max_disfluencies", max_disfluencies)):
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"profile {name!r}: escalate.{field} must be a non-negative integer")
+    if not isinstance(markers, list) or not all(isinstance(m, str) for m in markers):
+        raise ValueError(f"profile {name!r}: escalate.markers must be a list of strings")
+    return {
+        "always": bool(raw.get("always", False)),
+        "min_words": min_words,
+        "max_disfluencies": max_disfluencies,
+        "markers": phrase_pattern(markers),
+    }
+
+def count_disfluencies(escalation, text):
+    """Repeated words ("the the", "I- I") plus self-correction phrases."""
+    count = len(REPEATED_WORD.findall(text))
+    if escalation["markers"]:
+        count += len(escalation["markers"].findall(text))
+    return count
+
+def capitalize_sentence(m, text):
+    if m.group(1).startswith(".") and ABBREVIATION_END.search(text, 0, m.start() + 1):
+        return m.group(0)
+    return m.group(1) + m.group(2).upper()
+
+def apply_rules(rules, text):
+    if rules["fillers"]:
+        text = rules["fillers"].sub("", text)
+    if rules["replacements"]:
+        lookup = rules["replacement_map"]
+        text = rules["replacements"].sub(lambda m: lookup[m.group(0).lower()], text)
+
+    if rules["punctuate"]:
+        text = MULTI_SPACE.sub(" ", text)
+        text = SPACE_BEFORE_PUNCT.sub(r"\1", text)
+        text = REPEATED_PUNCT.sub(lambda m: m.group(1) or m.group(2), text)
+        text = COMMA_BEFORE_STOP.sub(r"\1", text)
+        text = MISSING_SPACE_AFTER.sub(r"\1 ", text)
+        text = LEADING_PUNCT.sub("", text).rstrip(" ,;:")
+        if text and text[-1] not in ".!?\n":
+            text += "."
+    else:
+        text = text.strip()
+
+    if rules["capitalize"]:
+        text = LOWER_I.sub("I", text)
+        text = SENTENCE_START.sub(lambda m: capitalize_sentence(m, text), text)
+    return text
+
+def local_format(name, profile, text):
+    """
+    Runs the profile's rules, if any. Returns (text, needs_llm); needs_llm
+    is False when the result is final and Ollama should be skipped.
+    """
+    rules = profile.get("rules")
+    if not rules:
+        return text, True
+
+    start = time.time()
+    escalation = profile["escalate"]
+    needs_llm = bool(profile["model"]) and (
+        escalation["always"]
+        or len(WORD.findall(text)) >= escalation["min_words"]
+        or count_disfluencies(escalation, text) > escalation["max_disfluencies"]
+    )
+    text = apply_rules(rules, text)
+    metrics.observe("stage_seconds", time.time() - start, stage="rules_format")
+    metrics.inc("format_route_total", route="llm" if needs_llm else "rules", profile=name)
+    return text, needs_llm
 
 # -------------------------------------------------------------------
 # Formatting Profiles
 # -------------------------------------------------------------------
+# format_config.json is parsed once into compiled profiles: every field is
+# validated and the parts of the Ollama request that do not depend on the
+# text are built up front. The file is watched and reloaded on change; an
+# invalid edit is logged and the previous profiles stay in effect.
 FORMAT_CONFIG_PATH = resource_path(os.path.join("config", "format_config.json"))
+FORMAT_CONFIG_POLL_INTERVAL = 2   # seconds
+
+# How long Ollama keeps a profile's LLM loaded after a request. -1 pins it
+# for as long as the profile is selected; a profile can set its own
+# "keep_alive" (e.g. "30m") to let Ollama unload it when idle.
+OLLAMA_KEEP_ALIVE = -1
+
+DEFAULT_FORMAT_CONFIG = {"formats": {"disable": {"enabled": False}}}
+
+def compile_profile(name, raw):
+    """Validates one profile; raises ValueError describing the first problem."""
+    if not isinstance(raw, dict):
+        raise ValueError(f"profile {name!r} must be an object")
+    enabled = raw.get("enabled", False)
+    if not isinstance(enabled, bool):
+        raise ValueError(f"profile {name!r}: enabled must be true or false")
+    if not enabled:
+        return {"enabled": False}
+
+    rules = compile_rules(name, raw["rules"]) if "rules" in raw else None
+    model = raw.get("model")
+    prompt = raw.get("system_prompt", "")
+    options = raw.get("options", {})
+    keep_alive = raw.get("keep_alive", OLLAMA_KEEP_ALIVE)
+    if rules and model is None:
+        # Local formatting only
+        return {"enabled": True, "model": None, "rules": rules, "escalate": compile_escalation(name, {})}
+    if not isinstance(model, str) or not model.strip():
+        raise ValueError(f"profile {name!r}: model is required")
+    if not isinstance(prompt, str):
+        raise ValueError(f"profile {name!r}: system_prompt must be a string")
+    if not isinstance(options, dict):
+        raise ValueError(f"profile {name!r}: options must be an object")
+    if isinstance(keep_alive, bool) or not isinstance(keep_alive, (int, str)):
+        raise ValueError(f"profile {name!r}: keep_alive must be a duration string or seconds")
+
+    return {
+        "enabled": True,
+        "model": model,
+        "rules": rules,
+        "escalate": compile_escalation(name, raw.get("escalate", {})),
+        "system_prompt": prompt,
+        "options": options,
+        "keep_alive": keep_alive,
+        # Request fields shared by every call; only the user message varies
+        "template": {"model": model, "keep_alive": keep_alive, "options": options},
+        "system_message": {"role": "system", "content": prompt},
+        "cache_id": content_key(model, prompt, options),
+    }
+
+def compile_format_config(cfg):
+    formats = cfg.get("formats") if isinstance(cfg, dict) else None
+    if not isinstance(formats, dict) or not formats:
+        raise ValueError('expected a non-empty "formats" object')
+    profiles = {name: compile_profile(name, raw) for name, raw in formats.items()}
+    profiles.setdefault("disable", {"enabled": False})
+    return {"formats": profiles}
 
 def load_format_config():
     try:
         with open(FORMAT_CONFIG_PATH, "r", encoding="utf-8") as f:
-            cfg = json.load(f)
+            cfg = compile_format_config(json.load(f))
             logger.info("Loaded format_config.json successfully.")
             return cfg
     except Exception as e:
         logger.error(f"Failed to load format_config.json: {e}", exc_info=True)
-        return {"formats": {"disable": {"enabled": False}}}
+        return compile_format_config(DEFAULT_FORMAT_CONFIG)
 
+def format_config_mtime():
+    try:
+        return os.stat(FORMAT_CONFIG_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+format_config_loaded_mtime = format_config_mtime()
 format_config = load_format_config()
 format_mode = "disable"
 
 # -------------------------------------------------------------------
-# Whisper Lazy Loader
+# Whisper Model Cache
 # -------------------------------------------------------------------
-def load_model_if_needed():
-    global model
+# Loaded models stay resident, keyed by (model file, device, precision),
+# so switching back to a recently used model does not reload it. Each
+# device has a memory budget; the least recently used entries are evicted
+# when a new model would not fit.
+MODEL_CACHE_BUDGET_MB = {"cpu": 4096, "cuda": 6144}
+
+model_cache = OrderedDict()   # key -> {"model", "bytes", "loaded_at", "last_used", "warm", "offloaded", "uses"}
+model_cache_lock = threading.RLock()
+model_loads = {}              # key -> Future of a load in progress
+
+def current_model_key():
+    return (model_name, device, model_precision)
+
+def entry_device(key, entry):
+    """Where an entry's weights live; offloaded CUDA models sit in host RAM."""
+    return "cpu" if entry.get("offloaded") else key[1]
+
+def model_memory_bytes(m):
+    # state_dict also covers the packed weights of quantized layers, which are not parameters
+    total = 0
+    for value in m.state_dict().values():
+        for t in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(t, torch.Tensor):
+                total += t.numel() * t.element_size()
+    return total
+
+def release_model_memory(dev):
+    gc.collect()
+    if dev == "cuda" and torch is not None:
+        torch.cuda.empty_cache()
+        try:
+            torch.cuda.ipc_collect()
+        except:
+            pass
+
+def evict_models(dev, incoming_bytes=0, keep=None):
+    """Evicts LRU entries on dev until incoming_bytes fits in its budget."""
+    budget = MODEL_CACHE_BUDGET_MB.get(dev, 0) * 1024 * 1024
+
+    with model_cache_lock:
+        used = sum(e["bytes"] for k, e in model_cache.items() if entry_device(k, e) == dev)
+        for key in [k for k, e in model_cache.items() if entry_device(k, e) == dev and k != keep]:
+            if used + incoming_bytes <= budget:
+                break
+            entry = model_cache.pop(key)
+            used -= entry["bytes"]
+            if key == long_form_pool_key:
+                shutdown_long_form_pool()
+            metrics.inc("model_unloads_total", reason="evicted")
+            logger.info(f"Evicted {key} from model cache ({entry['bytes'] / 2**20:.0f} MB).")
+
+    release_model_memory(dev)
+
+# Derived model files (converted or quantized weights) are cached next to
+# the source checkpoint as <stem>.<tag>.cache and tagged with the source's
+# size and mtime, so replacing a .pt file invalidates them.
+def model_cache_file(path, tag):
+    return f"{os.path.splitext(path)[0]}.{tag}.cache"
+
+def source_signature(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+# fp32 weights are converted once into <stem>.fp32.cache: a plain state dict
+# already cast to fp32, saved in torch's zip format so torch.load(mmap=True)
+# can map it. Loads then build the module skeleton on the meta device and
+# assign the mapped tensors directly, so nothing is read or copied until a
+# page is touched, and a reload after an idle unload is served from the
+# OS page cache.
+def convert_fp32_cache(path, cache):
+    start = time.time()
+    checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+    state = {
+        k: v.float() if v.is_floating_point() else v
+        for k, v in checkpoint["model_state_dict"].items()
+    }
+
+    tmp = cache + ".tmp"
+    torch.save({"source": source_signature(path), "dims": checkpoint["dims"], "model_state_dict": state}, tmp)
+    os.replace(tmp, cache)
+    logger.info(f"Converted {os.path.basename(path)} to {os.path.basename(cache)} in {time.time() - start:.2f}s")
+
+def build_mapped_model(saved):
+    """Whisper module around mmap'd tensors; nothing is allocated for the weights."""
+    from whisper.model import ModelDimensions
 
-    if model is not None:
-        return model
+    m = long_form_worker.whisper_skeleton(ModelDimensions(**saved["dims"]))
+    m.load_state_dict(saved["model_state_dict"], assign=True)
+    return long_form_worker.finish_skeleton(m)
 
-    logger.info(f"Lazy-loading Whisper model: {model_path} (device={device})")
+def load_fp32_model(path, dev):
+    cache = model_cache_file(path, "fp32")
 
     try:
-        model = whisper.load_model(model_path, device=device)
+        saved = None
+        if os.path.exists(cache):
+            saved = torch.load(cache, map_location="cpu", mmap=True, weights_only=True)
+            if saved.get("source") != source_signature(path):
+                logger.info(f"{cache} is stale, converting again.")
+                saved = None
+        if saved is None:
+            convert_fp32_cache(path, cache)
+            saved = torch.load(cache, map_location="cpu", mmap=True, weights_only=True)
+        return build_mapped_model(saved).to(dev)
+
+    except Exception as e:
+        logger.warning(f"Memory-mapped load of {os.path.basename(path)} failed, using whisper.load_model: {e}")
+        return whisper.load_model(path, device=dev)
+
+def load_int8_model(path):
+    cache = model_cache_file(path, "int8")
+    signature = source_signature(path)
+
+    if os.path.exists(cache):
+        try:
+            # Only tensors are stored (no pickled module), so weights_only
+            # loading cannot run code from a tampered cache file
+            saved = torch.load(cache, map_location="cpu", weights_only=True)
+            if saved.get("source") == signature:
+                return long_form_worker.build_int8_model(saved)
+            logger.info(f"{cache} is stale, re-quantizing.")
+        except Exception as e:
+            logger.warning(f"Could not read {cache}, re-quantizing: {e}")
+
+    start = time.time()
+    m = long_form_worker.quantize_int8(load_fp32_model(path, "cpu"))
+    logger.info(f"Quantized {os.path.basename(path)} to int8 in {time.time() - start:.2f}s")
+
+    try:
+        tmp = cache + ".tmp"
+        torch.save({"source": signature, "dims": vars(m.dims), "model_state_dict": m.state_dict()}, tmp)
+        os.replace(tmp, cache)
+    except OSError as e:
+        logger.warning(f"Could not write {cache}: {e}")
+    return m
+
+def load_model_if_needed():
+    import_inference_libs()
+    key = current_model_key()
+    path = model_path
+
+    with model_cache_lock:
+        entry = model_cache.get(key)
+        if entry is not None:
+            model_cache.move_to_end(key)
+            entry["last_used"] = time.time()
+            entry["uses"].append(entry["last_used"])
+            if entry["offloaded"]:
+                start = time.time()
+                entry["model"].to(key[1])
+                entry["offloaded"] = False
+                metrics.inc("model_restores_total", model=key[0], device=key[1], precision=key[2])
+                logger.info(f"Moved offloaded {key} back to {key[1]} in {time.time() - start:.2f}s")
+            return entry["model"]
+
+        # Requests arriving mid-load wait for that load instead of starting another
+        pending = model_loads.get(key)
+        owner = pending is None
+        if owner:
+            pending = model_loads[key] = Future()
+
+    if not owner:
+        logger.info(f"Waiting for in-flight load of {key}")
+        return pending.result()
+
+    logger.info(f"Loading Whisper model: {path} (device={key[1]}, precision={key[2]})")
+
+    try:
+        start = time.time()
+        if key[2] == "int8":
+            m = load_int8_model(path)
+        else:
+            m = load_fp32_model(path, key[1])
+        instrument_model(m)
+        metrics.inc("model_loads_total", model=key[0], device=key[1], precision=key[2])
+        metrics.observe("model_load_seconds", time.time() - start, model=key[0], device=key[1], precision=key[2])
+
+        size = model_memory_bytes(m)
+        budget = MODEL_CACHE_BUDGET_MB.get(key[1], 0) * 1024 * 1024
+        if size > budget:
+            logger.warning(f"{key[0]} needs {size / 2**20:.0f} MB, over the {key[1]} budget; keeping it alone.")
+
+        evict_models(key[1], incoming_bytes=size, keep=key)
+        now = time.time()
+        with model_cache_lock:
+            model_cache[key] = {
+                "model": m, "bytes": size, "loaded_at": now, "last_used": now, "warm": False,
+                "offloaded": False, "uses": deque([now], maxlen=500),
+            }
+        logger.info(f"Model cached: {key} ({size / 2**20:.0f} MB)")
+
+        pending.set_result(m)
+        return m
+
     except Exception as e:
         logger.error(f"Failed to load Whisper model: {e}", exc_info=True)
-        model = None
+        pending.set_exception(e)
         raise
 
-    return model
+    finally:
+        with model_cache_lock:
+            model_loads.pop(key, None)
+
+# Per-job stage clock filled in by the hooks below. Only the inference
+# worker runs models, so a single module-level dict is enough.
+stage_clock = {"mel": 0.0, "encoder": 0.0, "decoder": 0.0}
+
+def instrument_model(m):
+    """Adds cancellation and encoder/decoder timing hooks to a loaded model."""
+    def pre(module, args):
+        # Lets the scheduler abort a cancelled job between forward passes
+        scheduler.check_cancelled()
+        module._stage_start = time.perf_counter()
+
+    def post(stage):
+        def hook(module, args, output):
+            # CUDA kernels run async; sync so the time covers the actual work
+            if isinstance(output, torch.Tensor) and output.is_cuda:
+                torch.cuda.synchronize()
+            stage_clock[stage] += time.perf_counter() - module._stage_start
+        return hook
+
+    for stage, module in (("encoder", m.encoder), ("decoder", m.decoder)):
+        module.register_forward_pre_hook(pre)
+        module.register_forward_hook(post(stage))
+
+# whisper.transcribe computes the mel spectrogram internally; wrap the
+# reference it uses so that stage is timed too. Installed by
+# import_inference_libs() once whisper is imported.
+_log_mel_spectrogram = None
+
+def timed_log_mel_spectrogram(*args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return _log_mel_spectrogram(*args, **kwargs)
+    finally:
+        stage_clock["mel"] += time.perf_counter() - start
+
+def instrument_mel_stage():
+    global _log_mel_spectrogram
+    module = sys.modules["whisper.transcribe"]
+    if module.log_mel_spectrogram is not timed_log_mel_spectrogram:
+        _log_mel_spectrogram = module.log_mel_spectrogram
+        module.log_mel_spectrogram = timed_log_mel_spectrogram
+
+def reset_stage_clock():
+    for stage in stage_clock:
+        stage_clock[stage] = 0.0
+
+def record_inference(elapsed, audio_seconds, key):
+    for stage, seconds in stage_clock.items():
+        metrics.observe("stage_seconds", seconds, stage=stage)
+    if audio_seconds > 0:
+        metrics.observe(
+            "real_time_factor", elapsed / audio_seconds, buckets=RTF_BUCKETS,
+            model=key[0], device=key[1], precision=key[2],
+        )
+
+def warm_up_model():
+    """
+    Loads the selected model and runs a tiny decode on silence so kernels,
+    mel filters and allocators are initialized before real audio arrives.
+    """
+    key = current_model_key()
+    m = load_model_if_needed()
+
+    entry = model_cache.get(key)
+    if entry is None or entry["warm"]:
+        return
+
+    start = time.time()
+    mel = whisper.log_mel_spectrogram(
+        np.zeros(WINDOW_SAMPLES, dtype=np.float32), m.dims.n_mels
+    ).to(m.device)
+    options = whisper.DecodingOptions(
+        language="en", without_timestamps=True, sample_len=2, fp16=USE_FP16
+    )
+    with torch.no_grad():
+        whisper.decode(m, mel, options)
+
+    entry["warm"] = True
+    logger.info(f"Warm-up of {key} finished in {time.time() - start:.2f}s")
+
+def model_cache_summary():
+    now = time.time()
+    with model_cache_lock:
+        return [
+            {
+                "model": k[0],
+                "device": k[1],
+                "precision": k[2],
+                "mb": round(e["bytes"] / 2**20, 1),
+                "idle_seconds": round(now - e["last_used"], 1),
+                "offloaded": e["offloaded"],
+                "recent_uses": sum(1 for t in e["uses"] if now - t < EVICTION_POLICY["usage_window"]),
+            }
+            for k, e in reversed(model_cache.items())
+        ]
 
 def load_whisper_model(new_name, new_device):
-    global model, model_name, model_path, device, USE_FP16
+    global model_name, model_path, device, USE_FP16, model_precision
 
     device = new_device
     USE_FP16 = (device == "cuda")
+    if device != "cpu" and model_precision == "int8":
+        model_precision = "fp32"
+        logger.info("int8 precision is CPU only, switching to fp32.")
 
     model_name = new_name
     model_path = resource_path(os.path.join("models", new_name))
 
-    # Mark model for reload next time
-    model = None
-    logger.info(f"Whisper model selected: {model_path} (device={device}) — will reload on next use")
+    # Cached entries stay resident; a miss loads on next use
+    resident = current_model_key() in model_cache
+    logger.info(
+        f"Whisper model selected: {model_path} (device={device}) — "
+        + ("already resident" if resident else "will load on next use")
+    )
 
 # -------------------------------------------------------------------
-# Memory Watchdog: unload Whisper when idle
+# Inference Scheduler
 # -------------------------------------------------------------------
-def memory_watchdog():
-    global model, last_model_use
+# A single worker thread owns the models: every load, warm-up, inference
+# and unload runs on it, so Flask's request threads never touch a model
+# concurrently and nothing can be unloaded mid-inference. Jobs are served
+# by priority, then submission order. Queued jobs past their deadline are
+# dropped; cancelled jobs are removed from the queue, and a running job is
+# aborted at its next decoder step.
+PRIORITY_INTERACTIVE = 0   # the user is waiting on it
+PRIORITY_BACKGROUND = 1    # session windows committed while recording
+PRIORITY_BULK = 2          # batch jobs
+PRIORITY_MAINTENANCE = 3   # unloads and evictions, run once the queue is drained
+
+class JobCancelled(Exception):
+    pass
+
+class JobExpired(Exception):
+    pass
+
+class InferenceJob:
+    def __init__(self, fn, args, kwargs, priority, deadline, group, name):
+        # Run in the submitter's context so worker logs keep its trace ID
+        self.context = contextvars.copy_context()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.deadline = deadline
+        self.group = group
+        self.name = name or fn.__name__
+        self.submitted = time.time()
+        self.cancelled = False
+        self.future = Future()
+
+class InferenceScheduler:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []
+        self.seq = itertools.count()
+        self.current = None
+        self.counts = {"completed": 0, "failed": 0, "cancelled": 0, "expired": 0}
+        self.wait_times = deque(maxlen=200)
+        self.thread = threading.Thread(target=self._worker, name="inference-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, priority=PRIORITY_INTERACTIVE, deadline=None, group=None, name=None, **kwargs):
+        job = InferenceJob(fn, args, kwargs, priority, deadline, group, name)
+        with self.cond:
+            heapq.heappush(self.heap, (priority, next(self.seq), job))
+            self.cond.notify()
+        return job.future
+
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    def cancel_group(self, group):
+        """Cancels queued and running jobs of a group. Returns how many were hit."""
+        hit = 0
+        with self.cond:
+            kept = []
+            for item in self.heap:
+                job = item[2]
+                if job.group == group:
+                    job.future.set_exception(JobCancelled(f"{job.name} cancelled"))
+                    self.counts["cancelled"] += 1
+                    hit += 1
+                else:
+                    kept.append(item)
+            heapq.heapify(kept)
+            self.heap = kept
+
+            if self.current is not None and self.current.group == group:
+                self.current.cancelled = True
+                hit += 1
+        return hit
+
+    def check_cancelled(self):
+        job = self.current
+        if job is not None and job.cancelled and threading.current_thread() is self.thread:
+            raise JobCancelled(f"{job.name} cancelled")
+
+    def pending(self):
+        with self.cond:
+            return len(self.heap)
+
+    def idle(self):
+        with self.cond:
+            return not self.heap and self.current is None
+
+    def stats(self):
+        with self.cond:
+            waits = list(self.wait_times)
+            current = self.current
+            return {
+                "depth": len(self.heap),
+                "running": current.name if current is not None else None,
+                "running_for": round(time.time() - current.submitted, 3) if current is not None else 0.0,
+                "last_wait": round(waits[-1], 3) if waits else 0.0,
+                "avg_wait": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "max_wait": round(max(waits), 3) if waits else 0.0,
+                **self.counts,
+            }
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                _, _, job = heapq.heappop(self.heap)
+                self.current = job
+
+            started = time.time()
+            self.wait_times.append(started - job.submitted)
+            metrics.observe("stage_seconds", started - job.submitted, stage="queue_wait")
+            outcome = "completed"
 
-    while True:
-        time.sleep(30)
+            try:
+                if job.deadline is not None and started > job.deadline:
+                    raise JobExpired(f"{job.name} missed its deadline by {started - job.deadline:.2f}s")
+                result = job.context.run(job.fn, *job.args, **job.kwargs)
+            except JobCancelled as e:
+                outcome = "cancelled"
+                job.future.set_exception(e)
+            except JobExpired as e:
+                outcome = "expired"
+                job.future.set_exception(e)
+            except BaseException as e:
+                outcome = "failed"
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+
+            with self.cond:
+                self.current = None
+                self.counts[outcome] += 1
+
+            if outcome != "completed":
+                logger.info(f"Inference job {job.name} {outcome}.")
+
+scheduler = InferenceScheduler()
+
+def run_whisper(audio, initial_prompt=None):
+    """Worker-side inference; only call through the scheduler."""
+    key = current_model_key()
+    start = time.perf_counter()
+    whisper_model = load_model_if_needed()
+    metrics.observe("stage_seconds", time.perf_counter() - start, stage="model_load")
+
+    reset_stage_clock()
+    start = time.perf_counter()
+    out = whisper_model.transcribe(
+        audio, fp16=USE_FP16, language="en", task="transcribe",
+        initial_prompt=initial_prompt, **decode_options(),
+    )
+    record_inference(time.perf_counter() - start, len(audio) / SAMPLE_RATE, key)
+    update_idle_timer()
+    return (out.get("text") or "").strip()
+
+# Identical audio (a retry after a failed paste, a re-run, a duplicate
+# upload) is answered from a result cache instead of the model. The key is
+# a hash of the PCM that would reach Whisper plus everything that shapes
+# the text: model, device, precision, decoding options, prompt and the
+# model file's size and mtime, so replacing a file under models/ makes its
+# old entries unreachable. The disk tier is the usual persisted LRU JSON;
+# like the format cache it holds dictated text, so it is opt-in.
+TRANSCRIPT_CACHE_ENABLED = True
+TRANSCRIPT_CACHE_MAX_ENTRIES = 1000
+TRANSCRIPT_CACHE_TTL = 30 * 24 * 3600
+TRANSCRIPT_CACHE_PERSIST = False
+transcript_cache = LRUCache(
+    "transcript_cache", TRANSCRIPT_CACHE_MAX_ENTRIES,
+    ttl=TRANSCRIPT_CACHE_TTL, persist=TRANSCRIPT_CACHE_PERSIST,
+)
 
-        if model is None:
+def transcript_cache_key(audio, initial_prompt):
+    try:
+        signature = source_signature(model_path)
+    except OSError:
+        return None
+    pcm = hashlib.blake2b(np.ascontiguousarray(audio, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+    return content_key(pcm, current_model_key(), signature, decode_options(), initial_prompt, use_long_form(audio))
+
+def cache_transcript(key, job):
+    if not job.cancelled() and job.exception() is None:
+        transcript_cache.put(key, job.result())
+
+def submit_transcription(audio, initial_prompt=None, priority=PRIORITY_INTERACTIVE, group=None, deadline=None):
+    """
+    Runs the VAD stage and queues Whisper on a float32 array. Returns the
+    result dict and the job's Future, or None if there was no speech.
+    """
+    result = {"text": "", "audio_seconds": len(audio) / SAMPLE_RATE, "vad_removed_seconds": 0.0, "cached": False}
+
+    if VAD_ENABLED:
+        audio, removed = trim_silence(audio)
+        result["vad_removed_seconds"] = removed
+        metrics.inc("vad_removed_seconds_total", removed)
+        if removed:
+            logger.info(f"VAD removed {removed:.2f}s of {result['audio_seconds']:.2f}s.")
+
+    if len(audio) == 0:
+        logger.info("No speech detected, skipping Whisper.")
+        return result, None
+
+    key = transcript_cache_key(audio, initial_prompt) if TRANSCRIPT_CACHE_ENABLED else None
+    if key is not None:
+        cached = transcript_cache.get(key)
+        if cached is not None:
+            logger.info(f"Transcript cache hit ({result['audio_seconds']:.2f}s audio).")
+            result["cached"] = True
+            job = Future()
+            job.set_result(cached)
+            return result, job
+
+    if use_long_form(audio):
+        job = scheduler.submit(
+            run_whisper_long_form, audio,
+            priority=priority, deadline=deadline, group=group, name="transcribe-long",
+        )
+    else:
+        job = scheduler.submit(
+            run_whisper, audio, initial_prompt,
+            priority=priority, deadline=deadline, group=group, name="transcribe",
+        )
+    if key is not None:
+        job.add_done_callback(partial(cache_transcript, key))
+    return result, job
+
+def transcribe_audio(audio, initial_prompt=None, priority=PRIORITY_INTERACTIVE, group=None, deadline=None):
+    """
+    Runs the VAD stage and then Whisper on a float32 array.
+    Returns {"text", "audio_seconds", "vad_removed_seconds", "cached"}.
+    """
+    result, job = submit_transcription(audio, initial_prompt, priority, group, deadline)
+    if job is not None:
+        result["text"] = job.result()
+    return result
+
+def unload_all_models(reason):
+    """Worker-side unload; skipped if new work arrived after it was queued."""
+    if scheduler.pending():
+        logger.info(f"Skipping {reason} unload: inference queue is not empty.")
+        return
+
+    shutdown_long_form_pool()
+
+    with model_cache_lock:
+        devices = {k[1] for k in model_cache}
+        count = len(model_cache)
+        model_cache.clear()
+
+    for dev in devices:
+        release_model_memory(dev)
+
+    metrics.inc("model_unloads_total", count, reason=reason)
+    logger.info(f"Unloaded {count} Whisper model(s) ({reason}).")
+
+# -------------------------------------------------------------------
+# Parallel Long-Form Transcription (CPU)
+# -------------------------------------------------------------------
+# A single transcribe() call walks a long recording one 30 s window at a
+# time on one core-bound decode loop. On CPU, recordings longer than
+# LONG_FORM_MIN_SECONDS are instead cut at pauses into segments that each
+# fit in one window and decoded in parallel by a process pool.
+#
+# The pool is tied to one resident model. Its weights are moved into shared
+# memory once and handed to the workers, which map the same storages
+# read-only, so N workers do not cost N copies of the model. The pool is
+# shut down whenever that model is unloaded or evicted, and rebuilt lazily
+# for whichever model is current on the next long recording.
+#
+# Long-form jobs still run through the scheduler: the worker thread blocks
+# on the pool, so model ownership and cancellation work as for any job.
+LONG_FORM_ENABLED = True
+LONG_FORM_MIN_SECONDS = 90
+LONG_FORM_SEGMENT_SECONDS = 28      # stays inside one 30 s Whisper window
+LONG_FORM_CUT_SEARCH_SECONDS = 8    # how far back from the segment end to look for a pause
+LONG_FORM_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+long_form_pool = None
+long_form_pool_key = None
+
+def use_long_form(audio):
+    return (
+        LONG_FORM_ENABLED and LONG_FORM_WORKERS > 1 and device == "cpu"
+        and len(audio) >= LONG_FORM_MIN_SECONDS * SAMPLE_RATE
+    )
+
+def split_at_pauses(audio):
+    """Cuts audio into segments of at most LONG_FORM_SEGMENT_SECONDS at the quietest nearby frame."""
+    limit = LONG_FORM_SEGMENT_SECONDS * SAMPLE_RATE
+    segments = []
+    pos = 0
+
+    while len(audio) - pos > limit:
+        cut = pos + find_cut_point(audio[pos:pos + limit], limit, LONG_FORM_CUT_SEARCH_SECONDS)
+        segments.append(audio[pos:cut])
+        pos = cut
+
+    segments.append(audio[pos:])
+    return segments
+
+def merge_segment_texts(texts):
+    """
+    Joins segment transcripts in order. A word cut in half at a boundary is
+    often heard by both segments, so a short repeated run of words across
+    the join is dropped, and a segment that starts right after a finished
+    sentence is capitalized. When the repeat was dropped, the join falls
+    inside the segment's first sentence and its casing is left alone.
+    """
+    def norm(w):
+        return w.strip(".,!?;:\"'").lower()
+
+    words = []
+    for text in texts:
+        new = text.split()
+        if not new:
             continue
 
-        idle = time.time() - last_model_use
+        overlap = 0
+        for n in range(min(3, len(words), len(new)), 0, -1):
+            if [norm(w) for w in words[-n:]] == [norm(w) for w in new[:n]]:
+                overlap = n
+                break
+        new = new[overlap:]
 
-        if idle > IDLE_TIMEOUT:
-            logger.info(f"Idle timeout reached ({int(idle)}s). Unloading Whisper model...")
+        if new and not overlap and (not words or words[-1][-1] in ".!?"):
+            new[0] = new[0][:1].upper() + new[0][1:]
+        words.extend(new)
 
-            try:
-                del model
-                model = None
+    return " ".join(words)
 
-                gc.collect()
+def shutdown_long_form_pool():
+    global long_form_pool, long_form_pool_key
+    if long_form_pool is None:
+        return
 
-                if device == "cuda":
-                    torch.cuda.empty_cache()
-                    try:
-                        torch.cuda.ipc_collect()
-                    except:
-                        pass
+    try:
+        long_form_pool.terminate()
+        long_form_pool.join()
+    except Exception:
+        pass
+
+    logger.info(f"Long-form pool for {long_form_pool_key} shut down.")
+    long_form_pool = None
+    long_form_pool_key = None
+
+def get_long_form_pool(m, key):
+    """Worker-side; (re)starts the pool for the given resident model."""
+    global long_form_pool, long_form_pool_key
+    if long_form_pool is not None and long_form_pool_key == key:
+        return long_form_pool
+
+    shutdown_long_form_pool()
+
+    start = time.perf_counter()
+    threads = max(1, (os.cpu_count() or 1) // LONG_FORM_WORKERS)
+    if key[2] == "int8":
+        initargs = (threads, None, None, model_cache_file(resource_path(os.path.join("models", key[0])), "int8"))
+    else:
+        state = m.state_dict()
+        for tensor in state.values():
+            tensor.share_memory_()
+        initargs = (threads, vars(m.dims), state)
+    ctx = torch.multiprocessing.get_context("spawn")
+
+    # Spawned children re-import the parent's __main__ (run.py, which pulls
+    # in this whole server). Presenting the worker module as __main__ while
+    # the pool starts keeps the children down to torch and whisper.
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = long_form_worker
+    try:
+        long_form_pool = ctx.Pool(
+            LONG_FORM_WORKERS,
+            initializer=long_form_worker.init_worker,
+            initargs=initargs,
+        )
+    finally:
+        sys.modules["__main__"] = main
+
+    long_form_pool_key = key
+    logger.info(
+        f"Long-form pool started for {key}: {LONG_FORM_WORKERS} workers x {threads} threads "
+        f"in {time.perf_counter() - start:.2f}s."
+    )
+    return long_form_pool
+
+def run_whisper_long_form(audio):
+    """Worker-side long-form inference; only call through the scheduler."""
+    key = current_model_key()
+    start = time.perf_counter()
+    whisper_model = load_model_if_needed()
+    metrics.observe("stage_seconds", time.perf_counter() - start, stage="model_load")
+
+    pool = get_long_form_pool(whisper_model, key)
+    segments = split_at_pauses(audio)
+    options = {"fp16": False, "language": "en", "task": "transcribe", **decode_options()}
+
+    reset_stage_clock()
+    start = time.perf_counter()
+    pending = pool.starmap_async(long_form_worker.transcribe_segment, [(s, options) for s in segments])
+    while not pending.ready():
+        # Workers cannot be interrupted mid-segment; a cancelled job just
+        # stops waiting and the pool finishes the stale segments on its own.
+        scheduler.check_cancelled()
+        pending.wait(0.1)
+
+    texts = pending.get()
+    elapsed = time.perf_counter() - start
+    metrics.observe("stage_seconds", elapsed, stage="long_form")
+    record_inference(elapsed, len(audio) / SAMPLE_RATE, key)
+    update_idle_timer()
+    logger.info(f"Long-form: {len(segments)} segments of {len(audio) / SAMPLE_RATE:.1f}s audio in {elapsed:.2f}s.")
+    return merge_segment_texts(texts)
 
-                logger.info("Whisper successfully unloaded from memory.")
+# -------------------------------------------------------------------
+# Eviction Policy: keep, offload or unload idle models
+# -------------------------------------------------------------------
+# Every EVICTION_POLICY["interval"] seconds each resident model gets one of
+# three decisions:
+#   keep     - it stays where it is
+#   offload  - CUDA weights move to host RAM; the next use moves them back,
+#              which is much cheaper than a reload from disk
+#   unload   - it is dropped from memory
+# Idle limits grow with recent use (usage_bonus seconds per use in the last
+# usage_window, up to max_bonus), so a model used all day is not thrown
+# away over lunch. When RAM or VRAM use is above its pressure threshold the
+# bonus is ignored and anything idle for pressure_idle seconds is moved out.
+# Actions run as maintenance jobs and are dropped if the model was used in
+# the meantime. Every decision is counted in eviction_decisions_total.
+EVICTION_POLICY = {
+    "interval": 30,
+    "idle_offload": 120,            # CUDA -> host RAM after 2 minutes idle
+    "idle_unload": 300,             # unloaded after 5 minutes idle, as before the policy
+    "pressure_idle": 60,
+    "ram_pressure_percent": 85,
+    "vram_pressure_percent": 90,
+    "usage_window": 3600,
+    "usage_bonus": 60,
+    "max_bonus": 1800,
+}
+
+def memory_pressure():
+    """Which memory pools are above their pressure threshold."""
+    ram = psutil.virtual_memory().percent
+    pressure = {"ram_percent": ram, "ram": ram >= EVICTION_POLICY["ram_pressure_percent"],
+                "vram_percent": None, "vram": False}
+
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        free, total = torch.cuda.mem_get_info()
+        vram = round(100 * (total - free) / total, 1)
+        pressure["vram_percent"] = vram
+        pressure["vram"] = vram >= EVICTION_POLICY["vram_pressure_percent"]
+    return pressure
+
+def eviction_decision(key, entry, now, pressure):
+    """
+    Returns (action, code, reason) for one cache entry. code is a short
+    label for metrics ("pressure", "idle", "active", "bonus"); reason is
+    the human-readable detail for the log.
+    """
+    policy = EVICTION_POLICY
+    idle = now - entry["last_used"]
+    on_cuda = entry_device(key, entry) == "cuda"
+
+    recent = sum(1 for t in entry["uses"] if now - t < policy["usage_window"])
+    bonus = min(recent * policy["usage_bonus"], policy["max_bonus"])
+
+    if on_cuda and pressure["vram"] and idle >= policy["pressure_idle"]:
+        if pressure["ram"]:
+            return "unload", "pressure", "vram+ram pressure"
+        return "offload", "pressure", "vram pressure"
+    if not on_cuda and pressure["ram"] and idle >= policy["pressure_idle"]:
+        return "unload", "pressure", "ram pressure"
+
+    if idle >= policy["idle_unload"] + bonus:
+        return "unload", "idle", "idle"
+    if on_cuda and idle >= policy["idle_offload"] + bonus:
+        return "offload", "idle", "idle"
+
+    # Kept: either not idle long enough for the next step, or only thanks to the bonus
+    limit = policy["idle_offload"] if on_cuda else policy["idle_unload"]
+    if idle < limit:
+        return "keep", "active", "in use"
+    return "keep", "bonus", f"usage bonus {bonus}s"
+
+def apply_eviction(key, action, code, reason, seen_last_used):
+    """Worker-side; skipped if the model was used after the decision."""
+    with model_cache_lock:
+        entry = model_cache.get(key)
+        if entry is None or entry["last_used"] != seen_last_used:
+            logger.info(f"Eviction of {key} ({action}) skipped: model was used since.")
+            return
+
+        if action == "unload":
+            model_cache.pop(key)
+
+    if action == "offload":
+        start = time.time()
+        entry["model"].to("cpu")
+        entry["offloaded"] = True
+        release_model_memory("cuda")
+        logger.info(f"Offloaded {key} to host RAM in {time.time() - start:.2f}s ({reason}).")
+        return
+
+    if key == long_form_pool_key:
+        shutdown_long_form_pool()
+    release_model_memory(entry_device(key, entry))
+    metrics.inc("model_unloads_total", reason=code)
+    logger.info(f"Unloaded {key} ({reason}).")
+
+def eviction_loop():
+    while True:
+        time.sleep(max(1, EVICTION_POLICY["interval"]))
 
-            except Exception as e:
-                logger.error(f"Error during Whisper unload: {e}", exc_info=True)
+        if not model_cache:
+            continue
 
-threading.Thread(target=memory_watchdog, daemon=True).start()
+        now = time.time()
+        pressure = memory_pressure()
+        with model_cache_lock:
+            entries = list(model_cache.items())
+
+        for key, entry in entries:
+            action, code, reason = eviction_decision(key, entry, now, pressure)
+            metrics.inc("eviction_decisions_total", action=action, reason=code)
+
+            if action == "keep":
+                logger.debug(f"Eviction policy: keep {key} ({reason}).")
+                continue
+
+            vram = f", VRAM {pressure['vram_percent']}%" if pressure["vram_percent"] is not None else ""
+            logger.info(
+                f"Eviction policy: {action} {key} ({reason}; idle {int(now - entry['last_used'])}s, "
+                f"RAM {pressure['ram_percent']}%{vram})."
+            )
+            # Actions go through the scheduler so they never race an inference
+            scheduler.submit(
+                apply_eviction, key, action, code, reason, entry["last_used"],
+                priority=PRIORITY_MAINTENANCE, name=f"evict-{action}",
+            )
+
+threading.Thread(target=eviction_loop, daemon=True).start()
 
 # -------------------------------------------------------------------
 # MORE THEMES!
@@ -183,6 +1761,45 @@ def get_available_themes():
 # -------------------------------------------------------------------
 # ROUTES
 # -------------------------------------------------------------------
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    trace_id_var.set(request.headers.get("X-Trace-Id") or uuid.uuid4().hex[:12])
+
+@app.after_request
+def record_request_metrics(response):
+    response.headers["X-Trace-Id"] = trace_id_var.get()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.inc("requests_total", route=route, status=response.status_code)
+    if "request_start" in g:
+        metrics.observe("request_seconds", time.perf_counter() - g.request_start, route=route)
+    return response
+
+@metrics.gauges
+def collect_gauges():
+    q = scheduler.stats()
+    yield "queue_depth", "Inference jobs waiting in the queue.", {}, q["depth"]
+    yield "queue_running", "1 while the inference worker is busy.", {}, int(q["running"] is not None)
+    yield "sessions_open", "Incremental transcription sessions in progress.", {}, len(sessions)
+
+    with model_cache_lock:
+        resident = [(k, e["bytes"]) for k, e in model_cache.items()]
+    for (name, dev, precision), size in resident:
+        yield (
+            "resident_model_bytes", "Memory used by each resident Whisper model.",
+            {"model": name, "device": dev, "precision": precision}, size,
+        )
+
+    for cache in (format_cache, transcript_cache):
+        stats = cache.stats()
+        yield "cache_hits", "Result cache hits since start.", {"cache": cache.name}, stats["hits"]
+        yield "cache_misses", "Result cache misses since start.", {"cache": cache.name}, stats["misses"]
+        yield "cache_entries", "Entries held by each result cache.", {"cache": cache.name}, stats["entries"]
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -191,6 +1808,27 @@ def index():
 def bubble():
     return render_template("bubble.html", theme=theme_mode, timestamp=time.time())
 
+@app.route("/ready")
+def ready():
+    """
+    Readiness handshake polled by the client at startup. Stages:
+    http_up (this route answered), model_available (the selected model
+    file exists) and model_loaded (it is resident). Clients can show the
+    UI once ready is true; the model loads on the first /prepare.
+    """
+    stages = {
+        "http_up": True,
+        "model_available": os.path.isfile(model_path),
+        "model_loaded": current_model_key() in model_cache,
+    }
+    return jsonify({
+        "ready": stages["http_up"] and stages["model_available"],
+        "stages": stages,
+        "model": model_name,
+        "inference_libs_imported": inference_libs_ready,
+        "uptime_seconds": round(time.time() - SERVER_STARTED, 3),
+    })
+
 @app.route("/get_config")
 def get_config():
     try:
@@ -206,13 +1844,57 @@ def get_config():
         "device": device,
         "model": model_name,
         "models": models,
-        "loaded": model is not None,
+        "precision": model_precision,
+        "loaded": current_model_key() in model_cache,
+        "resident_models": model_cache_summary(),
+        "model_cache_budget_mb": MODEL_CACHE_BUDGET_MB,
+        "eviction_policy": EVICTION_POLICY,
+        "queue": scheduler.stats(),
+        "batch_size": BATCH_SIZE,
+        "vad": VAD_ENABLED,
+        "decode": decode_mode,
+        "decode_options": DECODE_PROFILES[decode_mode],
+        "available_decodes": list(DECODE_PROFILES.keys()),
+        "history": HISTORY_SETTINGS,
+        "long_form": {
+            "enabled": LONG_FORM_ENABLED,
+            "min_seconds": LONG_FORM_MIN_SECONDS,
+            "workers": LONG_FORM_WORKERS,
+            "pool": list(long_form_pool_key) if long_form_pool_key else None,
+        },
         "format": format_mode,
-        "available_formats": list(format_config.get("formats", {}).keys()),
+        "ollama_url": OLLAMA_URL,
+        "format_cache": format_cache.stats(),
+        "transcript_cache": transcript_cache.stats(),
+        "available_formats": list(format_config["formats"].keys()),
+        "resident_llm": resident_llm[0] if resident_llm else None,
         "themes": get_available_themes(),
         "theme": theme_mode
     })
 
+@app.route("/prepare", methods=["POST"])
+def prepare():
+    """Called when recording starts so the model load overlaps the user talking."""
+    update_idle_timer()
+    key = current_model_key()
+
+    entry = model_cache.get(key)
+    if entry is not None and entry["warm"]:
+        return jsonify({"status": "ready"})
+
+    def report(future):
+        if future.exception() is not None:
+            logger.error(f"Model warm-up failed: {future.exception()}")
+
+    scheduler.submit(warm_up_model, priority=PRIORITY_INTERACTIVE, name="warm-up").add_done_callback(report)
+    return jsonify({"status": "loading" if key in model_loads or entry is None else "warming"})
+
+@app.route("/unload", methods=["POST"])
+def unload():
+    """Drops every resident model once the queue drains (used for cold-start benchmarks)."""
+    scheduler.run(unload_all_models, "requested", priority=PRIORITY_MAINTENANCE, name="unload")
+    return jsonify({"status": "ok"})
+
 @app.route("/set_device", methods=["POST"])
 def set_device():
     data = request.json
@@ -239,18 +1921,100 @@ def set_model():
     logger.info(f"Model changed to {new_model}")
     return jsonify({"status": "ok"})
 
+@app.route("/set_precision", methods=["POST"])
+def set_precision():
+    global model_precision
+    data = request.json
+    precision = data.get("precision")
+
+    if precision not in MODEL_PRECISIONS:
+        logger.warning(f"Invalid precision requested: {precision}")
+        return jsonify({"error": "Invalid precision"}), 400
+
+    if precision == "int8" and device != "cpu":
+        logger.warning("int8 precision requested on a non-CPU device")
+        return jsonify({"error": "int8 precision is only available on CPU"}), 400
+
+    model_precision = precision
+    load_whisper_model(model_name, device)
+    logger.info(f"Precision changed to {precision}")
+    return jsonify({"status": "ok"})
+
+@app.route("/set_model_budget", methods=["POST"])
+def set_model_budget():
+    data = request.json
+    dev = data.get("device")
+    mb = data.get("mb")
+
+    if dev not in MODEL_CACHE_BUDGET_MB or not isinstance(mb, (int, float)) or mb < 0:
+        logger.warning(f"Invalid model budget request: {data}")
+        return jsonify({"error": "Invalid budget"}), 400
+
+    MODEL_CACHE_BUDGET_MB[dev] = mb
+    scheduler.submit(
+        evict_models, dev, keep=current_model_key(),
+        priority=PRIORITY_MAINTENANCE, name="evict",
+    )
+    logger.info(f"Model cache budget for {dev} set to {mb} MB")
+    return jsonify({"status": "ok"})
+
+@app.route("/set_eviction_policy", methods=["POST"])
+def set_eviction_policy():
+    data = request.json or {}
+
+    bad = [
+        k for k, v in data.items()
+        if k not in EVICTION_POLICY or isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0
+    ]
+    if not data or bad:
+        logger.warning(f"Invalid eviction policy request: {data}")
+        return jsonify({"error": "Invalid eviction policy"}), 400
+
+    EVICTION_POLICY.update(data)
+    logger.info(f"Eviction policy updated: {data}")
+    return jsonify({"status": "ok"})
+
 @app.route("/set_format", methods=["POST"])
 def set_format():
     global format_mode
     data = request.json
     mode = data.get("format")
 
-    if mode not in format_config.get("formats", {}):
+    if mode not in format_config["formats"]:
         logger.warning(f"Unknown format profile: {mode}")
         return jsonify({"error": "Unknown format profile"}), 400
 
     format_mode = mode
     logger.info(f"Formatting mode set to {format_mode}")
+    request_llm_residency()
+    return jsonify({"status": "ok"})
+
+@app.route("/set_decode", methods=["POST"])
+def set_decode():
+    global decode_mode
+    data = request.json
+    mode = data.get("decode")
+
+    if mode not in DECODE_PROFILES:
+        logger.warning(f"Unknown decoding profile: {mode}")
+        return jsonify({"error": "Unknown decoding profile"}), 400
+
+    decode_mode = mode
+    logger.info(f"Decoding profile set to {decode_mode}")
+    return jsonify({"status": "ok"})
+
+@app.route("/set_vad", methods=["POST"])
+def set_vad():
+    global VAD_ENABLED
+    data = request.json
+    enabled = data.get("enabled")
+
+    if not isinstance(enabled, bool):
+        logger.warning(f"Invalid VAD setting: {enabled}")
+        return jsonify({"error": "Invalid VAD setting"}), 400
+
+    VAD_ENABLED = enabled
+    logger.info(f"VAD {'enabled' if VAD_ENABLED else 'disabled'}")
     return jsonify({"status": "ok"})
 
 @app.route("/set_theme", methods=["POST"])
@@ -270,9 +2034,143 @@ def set_theme():
 # -------------------------------------------------------------------
 # APPLY LLM FORMATTING
 # -------------------------------------------------------------------
+# One pooled session is reused for every Ollama call, so formatting does
+# not pay connection setup each time. keep_alive asks Ollama to keep the
+# LLM loaded between dictations (see OLLAMA_KEEP_ALIVE). OLLAMA_HOST is honored the same way the
+# Ollama CLI does, which also lets a local stand-in server be swapped in.
+OLLAMA_URL = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+if not OLLAMA_URL.startswith(("http://", "https://")):
+    OLLAMA_URL = "http://" + OLLAMA_URL
+OLLAMA_CONNECT_TIMEOUT = 2.0     # seconds
+OLLAMA_READ_TIMEOUT = 60.0       # seconds between bytes, not for the whole reply
+OLLAMA_LOAD_TIMEOUT = 120.0      # a cold model load can take a while
+
+# Repeated phrases (sign-offs, boilerplate) skip the LLM. The key covers
+# everything that shapes the output, so editing a profile invalidates its
+# entries automatically. Entries are dictated text, so they only go to
+# disk (and survive restart_app) when FORMAT_CACHE_PERSIST is turned on.
+FORMAT_CACHE_MAX_ENTRIES = 2000
+FORMAT_CACHE_TTL = 7 * 24 * 3600
+FORMAT_CACHE_PERSIST = False
+format_cache = LRUCache(
+    "format_cache", FORMAT_CACHE_MAX_ENTRIES,
+    ttl=FORMAT_CACHE_TTL, persist=FORMAT_CACHE_PERSIST,
+)
+
+ollama_session = http_client.Session()
+ollama_session.mount("http://", http_client.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=8))
+
+def get_active_profile():
+    return format_mode, format_config["formats"].get(format_mode, {})
+
+def build_chat_payload(profile, text, stream):
+    payload = dict(profile["template"])
+    payload["stream"] = stream
+    payload["messages"] = [profile["system_message"], {"role": "user", "content": text}]
+    return payload
+
+def format_cache_key(name, profile, text):
+    return content_key(name, profile["cache_id"], text)
+
+def ollama_chat(payload):
+    r = ollama_session.post(
+        f"{OLLAMA_URL}/api/chat", json=payload,
+        timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT),
+    )
+    r.raise_for_status()
+    return r.json().get("message", {}).get("content", "")
+
+def ollama_chat_stream(payload):
+    """Yields content pieces as Ollama produces them (NDJSON stream)."""
+    with ollama_session.post(
+        f"{OLLAMA_URL}/api/chat", json=payload, stream=True,
+        timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT),
+    ) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise RuntimeError(chunk["error"])
+            piece = chunk.get("message", {}).get("content", "")
+            if piece:
+                yield piece
+            # No break on "done": reading to the end of the chunked body
+            # lets the connection go back to the pool instead of being reset.
+
+def format_with_profile(text):
+    """Formats text with the active profile; returns the input on failure."""
+    name, profile = get_active_profile()
+    if not profile.get("enabled", False):
+        return text
+    text, needs_llm = local_format(name, profile, text)
+    if not needs_llm:
+        return text
+
+    key = format_cache_key(name, profile, text)
+    cached = format_cache.get(key)
+    if cached is not None:
+        logger.info(f"Format cache hit (profile={name})")
+        return cached
+
+    start = time.time()
+    try:
+        logger.info(f"Sending format request (profile={name})")
+        formatted = ollama_chat(build_chat_payload(profile, text, stream=False))
+    except Exception as e:
+        logger.error(f"Formatting failed: {e}", exc_info=True)
+        return text
+    finally:
+        metrics.observe("stage_seconds", time.time() - start, stage="llm_format")
+
+    if not formatted:
+        return text
+    format_cache.put(key, formatted)
+    return formatted
+
+def stream_with_profile(text):
+    """
+    Streaming variant of format_with_profile. If the LLM fails before the
+    first piece, the input text is yielded instead.
+    """
+    name, profile = get_active_profile()
+    if not profile.get("enabled", False):
+        yield text
+        return
+    text, needs_llm = local_format(name, profile, text)
+    if not needs_llm:
+        yield text
+        return
+
+    key = format_cache_key(name, profile, text)
+    cached = format_cache.get(key)
+    if cached is not None:
+        logger.info(f"Format cache hit (profile={name})")
+        yield cached
+        return
+
+    pieces = []
+    start = time.time()
+    try:
+        logger.info(f"Sending streaming format request (profile={name})")
+        for piece in ollama_chat_stream(build_chat_payload(profile, text, stream=True)):
+            pieces.append(piece)
+            yield piece
+    except Exception as e:
+        logger.error(f"Streaming formatting failed: {e}", exc_info=True)
+        if not pieces:
+            yield text
+        return
+    finally:
+        metrics.observe("stage_seconds", time.time() - start, stage="llm_format")
+
+    # Only complete replies are cached
+    if pieces:
+        format_cache.put(key, "".join(pieces))
+
 @app.route("/format_text", methods=["POST"])
 def format_text():
-    global format_mode, format_config
     update_idle_timer()
 
     data = request.json
@@ -282,76 +2180,1259 @@ def format_text():
         logger.warning("Formatting request missing text.")
         return jsonify({"error": "missing text"}), 400
 
-    profile = format_config.get("formats", {}).get(format_mode, {})
+    # Streaming relays tokens as plain text so the caller can paste early
+    if data.get("stream") or request.args.get("stream") == "1":
+        return Response(
+            stream_with_context(stream_with_profile(text)),
+            mimetype="text/plain; charset=utf-8",
+        )
 
-    if not profile.get("enabled", False):
-        return jsonify({"text": text})
+    return jsonify({"text": format_with_profile(text)})
 
-    model_name = profile.get("model")
-    system_prompt = profile.get("system_prompt", "")
-    options = profile.get("options", {})
+# -------------------------------------------------------------------
+# LLM Residency
+# -------------------------------------------------------------------
+# Selecting a profile loads its LLM in the background with the profile's
+# keep_alive, so the first formatted dictation does not pay Ollama's cold
+# load. The model of the previously selected profile is unloaded
+# (keep_alive 0) once no profile in use needs it. Requests are serialized
+# on one worker so a quick A -> B -> A switch ends with A loaded.
+resident_llm = None          # (model, keep_alive) this server asked Ollama to keep
+llm_residency_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-residency")
+
+def ollama_keep_alive(model, keep_alive):
+    """An empty /api/generate loads (or, with keep_alive 0, unloads) a model."""
+    r = ollama_session.post(
+        f"{OLLAMA_URL}/api/generate",
+        json={"model": model, "keep_alive": keep_alive, "stream": False},
+        timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_LOAD_TIMEOUT),
+    )
+    r.raise_for_status()
+
+def sync_llm_residency():
+    """Makes Ollama's loaded model match the active profile."""
+    global resident_llm
+    _, profile = get_active_profile()
+    wanted = (profile["model"], profile["keep_alive"]) if profile.get("model") else None
+    if wanted == resident_llm:
+        return
+
+    if resident_llm and (wanted is None or wanted[0] != resident_llm[0]):
+        try:
+            ollama_keep_alive(resident_llm[0], 0)
+            logger.info(f"Unloaded LLM {resident_llm[0]}")
+            metrics.inc("llm_residency_total", action="unload")
+        except Exception as e:
+            logger.warning(f"Could not unload LLM {resident_llm[0]}: {e}")
+        resident_llm = None
+
+    if wanted:
+        start = time.time()
+        try:
+            ollama_keep_alive(*wanted)
+            resident_llm = wanted
+            logger.info(f"Loaded LLM {wanted[0]} (keep_alive={wanted[1]}) in {time.time() - start:.2f}s")
+            metrics.inc("llm_residency_total", action="load")
+        except Exception as e:
+            logger.warning(f"Could not preload LLM {wanted[0]}: {e}")
+
+def request_llm_residency():
+    llm_residency_executor.submit(contextvars.copy_context().run, sync_llm_residency)
+
+def release_llm():
+    """At exit, give back a model pinned with keep_alive -1."""
+    if resident_llm:
+        try:
+            ollama_keep_alive(resident_llm[0], 0)
+        except Exception:
+            pass
 
-    payload = {
-        "model": model_name,
-        "stream": False,
-        "options": options,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": text}
-        ]
-    }
+atexit.register(release_llm)
 
+def reload_format_config():
+    """Applies an edited format_config.json; returns False if it was rejected."""
+    global format_config, format_mode
     try:
-        logger.info(f"Sending format request (profile={format_mode})")
-        r = http_client.post("http://localhost:11434/api/chat", json=payload)
-        r_json = r.json()
-        formatted = r_json.get("message", {}).get("content", text)
-        return jsonify({"text": formatted})
-
+        with open(FORMAT_CONFIG_PATH, "r", encoding="utf-8") as f:
+            cfg = compile_format_config(json.load(f))
     except Exception as e:
-        logger.error(f"Formatting failed: {e}", exc_info=True)
-        return jsonify({"text": text})
+        logger.error(f"Ignoring invalid format_config.json, keeping previous profiles: {e}")
+        return False
+
+    format_config = cfg
+    if format_mode not in cfg["formats"]:
+        logger.warning(f"Format profile {format_mode} was removed; formatting disabled.")
+        format_mode = "disable"
+    logger.info(f"Reloaded format_config.json ({len(cfg['formats'])} profiles).")
+    request_llm_residency()
+    return True
+
+def format_config_watcher():
+    global format_config_loaded_mtime
+    while True:
+        time.sleep(FORMAT_CONFIG_POLL_INTERVAL)
+        mtime = format_config_mtime()
+        if mtime is not None and mtime != format_config_loaded_mtime:
+            format_config_loaded_mtime = mtime
+            reload_format_config()
+
+threading.Thread(target=format_config_watcher, daemon=True).start()
 
 # -------------------------------------------------------------------
 # TRANSCRIBE
 # -------------------------------------------------------------------
 @app.route("/transcribe", methods=["POST"])
 def transcribe():
+    started = time.time()
     update_idle_timer()
 
-    if "file" not in request.files:
-        logger.warning("Missing audio file in request.")
-        return jsonify({"error": "Missing 'file'"}), 400
+    try:
+        audio = read_request_audio()
+    except Exception as e:
+        return audio_error_response(e, "transcribe request")
+
+    timeout = request.args.get("timeout", type=float)
+    deadline = time.time() + timeout if timeout else None
+
+    try:
+        logger.info(f"Starting transcription ({len(audio) / SAMPLE_RATE:.1f}s of audio)...")
+        result = transcribe_audio(audio, group=request.args.get("group"), deadline=deadline)
+        metrics.observe("stage_seconds", time.time() - started, stage="total")
+        logger.info("Transcription successful.")
+        record_transcript("transcribe", result["text"], audio_seconds=result["audio_seconds"])
+        return jsonify(result)
+
+    except JobCancelled as e:
+        logger.info(f"Transcription cancelled: {e}")
+        return jsonify({"error": "cancelled"}), 409
+
+    except JobExpired as e:
+        logger.warning(f"Transcription dropped: {e}")
+        return jsonify({"error": "deadline exceeded"}), 503
 
+    except Exception as e:
+        logger.error(f"Transcription failed: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+# -------------------------------------------------------------------
+# DICTATE (transcribe + format in one round trip)
+# -------------------------------------------------------------------
+# The client sends audio once and gets back the raw transcript, the text
+# formatted with the active profile and per-stage timings. With stream=1
+# the reply is NDJSON: a "raw" event, "delta" events as the formatted
+# text streams in, then a "done" event with the full text and timings.
+def dictation_response(result, timings, started, stream=False, source="dictate"):
+    raw = result.pop("text")
+    name, _ = get_active_profile()
+    result.update({"raw": raw, "format": name})
+
+    if not stream:
+        t = time.time()
+        result["text"] = format_with_profile(raw) if raw else raw
+        timings["format"] = time.time() - t
+        timings["total"] = time.time() - started
+        metrics.observe("stage_seconds", timings["total"], stage="total")
+        result["timings"] = {k: round(v, 4) for k, v in timings.items()}
+        record_transcript(source, raw, result["text"], name, result["audio_seconds"])
+        return jsonify(result)
+
+    def events():
+        yield json.dumps({"type": "raw", **result}) + "\n"
+
+        t = time.time()
+        pieces = []
+        for piece in (stream_with_profile(raw) if raw else ()):
+            pieces.append(piece)
+            yield json.dumps({"type": "delta", "text": piece}) + "\n"
+        timings["format"] = time.time() - t
+        timings["total"] = time.time() - started
+        metrics.observe("stage_seconds", timings["total"], stage="total")
+        record_transcript(source, raw, "".join(pieces), name, result["audio_seconds"])
+
+        yield json.dumps({
+            "type": "done",
+            "text": "".join(pieces),
+            "timings": {k: round(v, 4) for k, v in timings.items()},
+        }) + "\n"
+
+    return Response(stream_with_context(events()), mimetype="application/x-ndjson")
+
+@app.route("/dictate", methods=["POST"])
+def dictate():
+    started = time.time()
+    update_idle_timer()
+    timings = {}
+
+    try:
+        audio = read_request_audio(timings)
+    except Exception as e:
+        return audio_error_response(e, "dictate request")
+
+    try:
+        t = time.time()
+        result = transcribe_audio(audio, group=request.args.get("group"))
+        timings["transcribe"] = time.time() - t
+    except JobCancelled as e:
+        logger.info(f"Dictation cancelled: {e}")
+        return jsonify({"error": "cancelled"}), 409
+    except Exception as e:
+        logger.error(f"Dictation transcription failed: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+    return dictation_response(result, timings, started, stream=request.args.get("stream") == "1")
+
+# -------------------------------------------------------------------
+# BATCH TRANSCRIBE
+# -------------------------------------------------------------------
+# Many short clips in one request. Clips that fit in one 30 s window are
+# padded, stacked into a single log-mel batch and run through one encoder
+# pass; whisper.decode then decodes the batch together, finishing each
+# item at its own end-of-text token. Longer clips fall back to the normal
+# sliding-window transcribe. Each batch is one bulk-priority job, so
+# interactive dictation can slip in between batches.
+BATCH_SIZE = {"cpu": 8, "cuda": 16}
+BATCH_MAX_SIZE = 64
+
+def run_whisper_batch(clips):
+    """Worker-side batched decode of clips no longer than one window."""
     whisper_model = load_model_if_needed()
 
-    audio_file = request.files["file"]
-    ts = time.strftime("%Y%m%d_%H%M%S")
-    temp_path = os.path.join(TRANSCRIPTS_DIR, f"temp_{ts}.wav")
-    audio_file.save(temp_path)
+    key = current_model_key()
+    reset_stage_clock()
+    start = time.perf_counter()
+
+    # Per clip: whisper clamps each spectrogram against its own maximum, so
+    # a batched call would normalize every clip against the loudest one
+    mel = torch.stack([
+        timed_log_mel_spectrogram(
+            torch.from_numpy(whisper.pad_or_trim(a)).to(whisper_model.device), whisper_model.dims.n_mels,
+        )
+        for a in clips
+    ])
+    # One greedy pass: a batched decode has no per-item fallback ladder, and
+    # whisper's beam search does not support batched audio. The decoding
+    # profile still sets the no-speech and compression rules below.
+    profile = decode_options()
+    options = whisper.DecodingOptions(language="en", without_timestamps=True, fp16=USE_FP16)
+
+    with torch.no_grad():
+        results = whisper.decode(whisper_model, mel, options)
+
+    # Same no-speech rule as whisper.transcribe
+    no_speech, logprob = profile["no_speech_threshold"], profile["logprob_threshold"]
+    compression = profile["compression_ratio_threshold"]
+    texts = []
+    for clip, r in zip(clips, results):
+        if r.no_speech_prob > no_speech and r.avg_logprob < logprob:
+            texts.append("")
+        elif compression is not None and r.compression_ratio > compression:
+            # Repetitive output: retry with the profile's fallback ladder, or
+            # drop it if the profile has none (a retry would repeat it)
+            if len(profile["temperature"]) > 1:
+                out = whisper_model.transcribe(clip, fp16=USE_FP16, language="en", task="transcribe", **profile)
+                texts.append((out.get("text") or "").strip())
+            else:
+                texts.append("")
+        else:
+            texts.append(r.text.strip())
+
+    record_inference(time.perf_counter() - start, sum(len(a) for a in clips) / SAMPLE_RATE, key)
+    update_idle_timer()
+    return texts
+
+@app.route("/transcribe_batch", methods=["POST"])
+def transcribe_batch():
+    update_idle_timer()
+
+    uploads = request.files.getlist("files")
+    if not uploads:
+        logger.warning("Missing audio files in batch request.")
+        return jsonify({"error": "Missing 'files'"}), 400
+
+    batch_size = request.args.get("batch_size", BATCH_SIZE.get(device, 8), type=int)
+    batch_size = max(1, min(batch_size, BATCH_MAX_SIZE))
+
+    results = []
+    short, long = [], []    # (result index, audio)
 
+    for i, upload in enumerate(uploads):
+        item = {"index": i, "name": upload.filename, "text": ""}
+        results.append(item)
+        try:
+            audio = load_uploaded_file(upload)
+        except Exception as e:
+            item["error"] = str(e)
+            continue
+
+        item["audio_seconds"] = len(audio) / SAMPLE_RATE
+        item["vad_removed_seconds"] = 0.0
+        if VAD_ENABLED:
+            audio, item["vad_removed_seconds"] = trim_silence(audio)
+
+        if len(audio) == 0:
+            continue
+        (short if len(audio) <= WINDOW_SAMPLES else long).append((i, audio))
+
+    start = time.time()
     try:
-        logger.info("Starting transcription...")
-        result = whisper_model.transcribe(
-            temp_path, fp16=USE_FP16, language="en", task="transcribe"
+        futures = [
+            (chunk, scheduler.submit(
+                run_whisper_batch, [a for _, a in chunk],
+                priority=PRIORITY_BULK, name=f"batch[{len(chunk)}]",
+            ))
+            for chunk in (short[k:k + batch_size] for k in range(0, len(short), batch_size))
+        ]
+        futures += [
+            ([(i, a)], scheduler.submit(run_whisper, a, priority=PRIORITY_BULK, name="batch-long"))
+            for i, a in long
+        ]
+
+        for chunk, future in futures:
+            texts = future.result()
+            if isinstance(texts, str):
+                texts = [texts]
+            for (i, _), text in zip(chunk, texts):
+                results[i]["text"] = text
+                record_transcript("batch", text, audio_seconds=results[i]["audio_seconds"])
+
+    except Exception as e:
+        logger.error(f"Batch transcription failed: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+    logger.info(
+        f"Batch of {len(uploads)} clip(s) done in {time.time() - start:.2f}s "
+        f"({len(short)} batched at size {batch_size}, {len(long)} long)."
+    )
+    return jsonify({"results": results, "batch_size": batch_size})
+
+@app.route("/set_batch_size", methods=["POST"])
+def set_batch_size():
+    data = request.json
+    dev = data.get("device")
+    size = data.get("size")
+
+    if dev not in BATCH_SIZE or not isinstance(size, int) or not 1 <= size <= BATCH_MAX_SIZE:
+        logger.warning(f"Invalid batch size request: {data}")
+        return jsonify({"error": "Invalid batch size"}), 400
+
+    BATCH_SIZE[dev] = size
+    logger.info(f"Batch size for {dev} set to {size}")
+    return jsonify({"status": "ok"})
+
+# -------------------------------------------------------------------
+# INCREMENTAL TRANSCRIPTION SESSIONS
+# -------------------------------------------------------------------
+# While recording, the client streams PCM chunks into a session. Whenever
+# STREAM_WINDOW_SECONDS of uncommitted audio is buffered, a window is cut at
+# the quietest point near its end and transcribed in the background. On
+# finalize only the uncommitted tail is left to decode, so stop-to-text
+# latency is bounded by one window instead of the whole recording.
+STREAM_WINDOW_SECONDS = 15
+STREAM_CUT_SEARCH_SECONDS = 2     # how far back from the window end to look for a pause
+STREAM_MIN_TAIL_SECONDS = 0.2     # shorter tails are not worth a model call
+SESSION_TTL = 600                 # abandoned sessions are dropped after 10 minutes
+
+sessions = {}
+sessions_lock = threading.Lock()
+session_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-window")
+
+def find_cut_point(audio, target, search_seconds=STREAM_CUT_SEARCH_SECONDS):
+    """Index of the quietest 20 ms frame in the search range ending at target."""
+    frame = SAMPLE_RATE // 50
+    start = max(0, target - int(search_seconds * SAMPLE_RATE))
+    n_frames = (target - start) // frame
+    if n_frames < 1:
+        return target
+
+    frames = audio[start:start + n_frames * frame].reshape(n_frames, frame)
+    energy = np.einsum("ij,ij->i", frames, frames)
+    return start + int(np.argmin(energy)) * frame + frame // 2
+
+def transcribe_window(session_id, audio, previous):
+    # Windows run one at a time on session_executor, so the previous
+    # window is already finished and its text can prime this one.
+    prompt = None
+    if previous is not None:
+        try:
+            prompt = previous.result()["text"]
+        except Exception:
+            pass
+    return transcribe_audio(audio, initial_prompt=prompt or None, priority=PRIORITY_BACKGROUND, group=session_id)
+
+class TranscriptionSession:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.lock = threading.Lock()
+        self.pending = []           # uncommitted float32 chunks
+        self.pending_samples = 0
+        self.windows = []           # futures of committed windows, in order
+        self.total_samples = 0
+        self.last_activity = time.time()
+
+    def append(self, audio):
+        window = STREAM_WINDOW_SECONDS * SAMPLE_RATE
+
+        with self.lock:
+            self.last_activity = time.time()
+            self.pending.append(audio)
+            self.pending_samples += len(audio)
+            self.total_samples += len(audio)
+
+            while self.pending_samples >= window:
+                buf = np.concatenate(self.pending)
+                cut = find_cut_point(buf, window)
+                self._commit(buf[:cut])
+                self.pending = [buf[cut:]]
+                self.pending_samples = len(buf) - cut
+
+    def _commit(self, audio):
+        previous = self.windows[-1] if self.windows else None
+        # copy_context keeps the request's trace ID on the window's jobs
+        self.windows.append(session_executor.submit(
+            contextvars.copy_context().run, transcribe_window, self.id, audio, previous,
+        ))
+        logger.info(f"Session {self.id}: committed window {len(self.windows)} ({len(audio) / SAMPLE_RATE:.1f}s)")
+
+    def finalize(self):
+        with self.lock:
+            tail = np.concatenate(self.pending) if self.pending else np.zeros(0, dtype=np.float32)
+            self.pending = []
+            self.pending_samples = 0
+
+        results = [f.result() for f in self.windows]
+
+        if len(tail) >= STREAM_MIN_TAIL_SECONDS * SAMPLE_RATE:
+            prompt = results[-1]["text"] if results else None
+            results.append(transcribe_audio(tail, initial_prompt=prompt or None, group=self.id))
+
+        return {
+            "text": " ".join(r["text"] for r in results if r["text"]),
+            "audio_seconds": self.total_samples / SAMPLE_RATE,
+            "vad_removed_seconds": sum(r["vad_removed_seconds"] for r in results),
+        }
+
+    def cancel(self):
+        for f in self.windows:
+            f.cancel()
+        scheduler.cancel_group(self.id)
+
+def get_session(session_id):
+    with sessions_lock:
+        return sessions.get(session_id)
+
+def drop_stale_sessions():
+    now = time.time()
+    with sessions_lock:
+        stale = [sid for sid, s in sessions.items() if now - s.last_activity > SESSION_TTL]
+        for sid in stale:
+            sessions.pop(sid).cancel()
+            logger.warning(f"Session {sid} expired without finalize.")
+
+@app.route("/session/open", methods=["POST"])
+def session_open():
+    update_idle_timer()
+    drop_stale_sessions()
+
+    # A new recording makes any still-open session stale (the client only
+    # records one at a time), so its queued windows are cancelled.
+    if (request.get_json(silent=True) or {}).get("cancel_stale"):
+        with sessions_lock:
+            stale = list(sessions.values())
+            sessions.clear()
+        for old in stale:
+            old.cancel()
+            logger.info(f"Session {old.id} cancelled by a new recording.")
+
+    session = TranscriptionSession(uuid.uuid4().hex)
+    with sessions_lock:
+        sessions[session.id] = session
+
+    logger.info(f"Session {session.id} opened.")
+    return jsonify({"session": session.id, "window_seconds": STREAM_WINDOW_SECONDS})
+
+@app.route("/session/<session_id>/append", methods=["POST"])
+def session_append(session_id):
+    session = get_session(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+
+    try:
+        audio = read_request_audio()
+    except Exception as e:
+        return audio_error_response(e, "session append")
+
+    session.append(audio)
+    return jsonify({
+        "status": "ok",
+        "committed_windows": len(session.windows),
+        "buffered_seconds": session.pending_samples / SAMPLE_RATE,
+    })
+
+@app.route("/session/<session_id>/finalize", methods=["POST"])
+def session_finalize(session_id):
+    """Finishes a session; with ?format=1 the reply matches /dictate."""
+    started = time.time()
+    update_idle_timer()
+    timings = {}
+
+    with sessions_lock:
+        session = sessions.pop(session_id, None)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+
+    # The final chunk may ride along with the finalize call
+    if request.content_length:
+        try:
+            session.append(read_request_audio(timings))
+        except Exception as e:
+            session.cancel()
+            return audio_error_response(e, "session finalize")
+
+    try:
+        t = time.time()
+        result = session.finalize()
+        timings["transcribe"] = time.time() - t
+        logger.info(
+            f"Session {session_id} finalized "
+            f"({result['audio_seconds']:.1f}s, {len(session.windows)} background windows, "
+            f"VAD removed {result['vad_removed_seconds']:.1f}s)."
         )
-        text = (result.get("text") or "").strip()
-        logger.info("Transcription successful.")
-        return jsonify({"text": text})
+        if request.args.get("format") == "1":
+            return dictation_response(
+                result, timings, started, stream=request.args.get("stream") == "1", source="session",
+            )
+        metrics.observe("stage_seconds", time.time() - started, stage="total")
+        record_transcript("session", result["text"], audio_seconds=result["audio_seconds"])
+        return jsonify(result)
+
+    except JobCancelled as e:
+        logger.info(f"Session {session_id} cancelled: {e}")
+        return jsonify({"error": "cancelled"}), 409
 
     except Exception as e:
-        logger.error(f"Transcription failed: {e}", exc_info=True)
+        logger.error(f"Session transcription failed: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-    finally:
+@app.route("/session/<session_id>/cancel", methods=["POST"])
+def session_cancel(session_id):
+    with sessions_lock:
+        session = sessions.pop(session_id, None)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+
+    session.cancel()
+    logger.info(f"Session {session_id} cancelled.")
+    return jsonify({"status": "ok"})
+
+# -------------------------------------------------------------------
+# INFERENCE QUEUE
+# -------------------------------------------------------------------
+@app.route("/queue")
+def queue_status():
+    return jsonify(scheduler.stats())
+
+@app.route("/cancel", methods=["POST"])
+def cancel_jobs():
+    data = request.json or {}
+    group = data.get("group")
+
+    if not group:
+        logger.warning("Missing group in cancel request")
+        return jsonify({"error": "Missing group"}), 400
+
+    with sessions_lock:
+        session = sessions.pop(group, None)
+    if session is not None:
+        session.cancel()
+
+    hit = scheduler.cancel_group(group)
+    logger.info(f"Cancelled {hit} job(s) in group {group}")
+    return jsonify({"status": "ok", "cancelled": hit})
+
+# -------------------------------------------------------------------
+# TRANSCRIPT HISTORY
+# -------------------------------------------------------------------
+# Every raw transcript, and the formatted text where there is one, goes into
+# a local SQLite store with an FTS5 index, so past dictations can be found
+# and reused instead of dictated again. Request handlers only enqueue; one
+# writer thread inserts in batches (one transaction per HISTORY_BATCH_SIZE
+# rows or HISTORY_FLUSH_SECONDS) and also owns retention and compaction.
+# Reads use per-thread connections; WAL keeps them off the writer's lock.
+#
+# /history and /search page with a keyset cursor (?before=<id>), not an
+# OFFSET, so every page is an index range scan whatever its depth.
+HISTORY_DB = os.path.join(TRANSCRIPTS_DIR, "history.sqlite3")
+HISTORY_SETTINGS = {
+    "enabled": True,
+    "retention_days": 365,       # 0 keeps entries forever
+    "max_entries": 500_000,      # 0 = no cap; oldest entries go first
+}
+HISTORY_BATCH_SIZE = 200
+HISTORY_FLUSH_SECONDS = 2.0
+HISTORY_MAINTENANCE_SECONDS = 3600
+HISTORY_PAGE_MAX = 200
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    source TEXT NOT NULL,
+    raw TEXT NOT NULL,
+    formatted TEXT,
+    format TEXT,
+    model TEXT,
+    audio_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS transcripts_created ON transcripts(created);
+CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+    raw, formatted, content='transcripts', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS transcripts_ai AFTER INSERT ON transcripts BEGIN
+    INSERT INTO transcripts_fts(rowid, raw, formatted) VALUES (new.id, new.raw, new.formatted);
+END;
+CREATE TRIGGER IF NOT EXISTS transcripts_ad AFTER DELETE ON transcripts BEGIN
+    INSERT INTO transcripts_fts(transcripts_fts, rowid, raw, formatted)
+    VALUES ('delete', old.id, old.raw, old.formatted);
+END;
+"""
+
+history_queue = queue.Queue()
+history_local = threading.local()
+history_last_maintenance = 0.0
+
+def history_connect():
+    conn = sqlite3.connect(HISTORY_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    # auto_vacuum only takes effect on a new database, so it must come
+    # before journal_mode, which already writes the file header
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def history_reader():
+    conn = getattr(history_local, "conn", None)
+    if conn is None:
+        conn = history_local.conn = history_connect()
+    return conn
+
+def record_transcript(source, raw, formatted=None, fmt=None, audio_seconds=None):
+    """Queues a transcript for the history store; never blocks the caller."""
+    if not HISTORY_SETTINGS["enabled"] or not raw or not raw.strip():
+        return
+    history_queue.put((time.time(), source, raw, formatted, fmt, model_name, audio_seconds))
+
+def history_maintenance(conn):
+    """Applies retention and compacts the index and file. Writer thread only."""
+    global history_last_maintenance
+    start = time.time()
+    removed = 0
+
+    days = HISTORY_SETTINGS["retention_days"]
+    if days:
+        removed += conn.execute("DELETE FROM transcripts WHERE created < ?", (time.time() - days * 86400,)).rowcount
+
+    cap = HISTORY_SETTINGS["max_entries"]
+    if cap:
+        removed += conn.execute(
+            "DELETE FROM transcripts WHERE id <= (SELECT id FROM transcripts ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (cap,),
+        ).rowcount
+    conn.commit()
+
+    # Merge FTS segments and return freed pages to the filesystem
+    conn.execute("INSERT INTO transcripts_fts(transcripts_fts) VALUES ('optimize')")
+    conn.commit()
+    # The pragma frees one page per step and execute() only steps once;
+    # executescript() runs it to completion
+    conn.executescript("PRAGMA incremental_vacuum;")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    history_last_maintenance = time.time()
+    metrics.inc("history_removed_total", removed)
+    logger.info(f"History maintenance removed {removed} entries in {time.time() - start:.2f}s.")
+
+def history_write(conn, rows):
+    start = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT INTO transcripts (created, source, raw, formatted, format, model, audio_seconds) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    metrics.inc("history_writes_total", len(rows))
+    metrics.observe("stage_seconds", time.time() - start, stage="history_write")
+
+def history_writer():
+    try:
+        conn = history_connect()
+        conn.executescript(HISTORY_SCHEMA)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0:
+            # Created without it (by an earlier version); VACUUM converts the file once
+            logger.info("Enabling incremental vacuum on the transcript history.")
+            conn.execute("VACUUM")
+    except Exception as e:
+        logger.error(f"Transcript history disabled, could not open {HISTORY_DB}: {e}", exc_info=True)
+        HISTORY_SETTINGS["enabled"] = False
+        return
+
+    while True:
+        rows = []
+        deadline = time.time() + HISTORY_FLUSH_SECONDS
+        while len(rows) < HISTORY_BATCH_SIZE:
+            try:
+                item = history_queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if item is None:            # flush request from flush_history()
+                history_queue.task_done()
+                break
+            rows.append(item)
+            history_queue.task_done()
+
         try:
-            os.remove(temp_path)
-        except:
+            if rows:
+                history_write(conn, rows)
+            if time.time() - history_last_maintenance > HISTORY_MAINTENANCE_SECONDS:
+                history_maintenance(conn)
+        except Exception as e:
+            logger.error(f"Transcript history write failed ({len(rows)} rows dropped): {e}", exc_info=True)
+
+def flush_history():
+    """Waits until everything queued so far has been written."""
+    if not history_thread.is_alive():
+        return
+    history_queue.put(None)
+    history_queue.join()
+
+history_thread = threading.Thread(target=history_writer, daemon=True, name="history-writer")
+history_thread.start()
+atexit.register(flush_history)
+
+def fts_query(text):
+    """User text -> FTS5 query: every word must match, the last one as a prefix."""
+    words = [w.replace('"', '""') for w in text.split()]
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def history_page_args():
+    limit = min(max(request.args.get("limit", 50, type=int), 1), HISTORY_PAGE_MAX)
+    before = request.args.get("before", type=int)
+    return limit, before if before is not None else 2**63 - 1
+
+def history_page(sql, params, limit):
+    """Runs a page query; a database that cannot be read answers 503 instead of a 500."""
+    try:
+        rows = history_reader().execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Transcript history query failed: {e}", exc_info=True)
+        # Drop the connection so the next request opens a fresh one
+        try:
+            history_local.conn.close()
+        except Exception:
             pass
+        history_local.conn = None
+        return jsonify({"error": "history unavailable"}), 503
+
+    items = [dict(r) for r in rows]
+    return jsonify({
+        "items": items,
+        "next_before": items[-1]["id"] if len(items) == limit else None,
+    })
+
+@app.route("/history")
+def history():
+    limit, before = history_page_args()
+    return history_page(
+        "SELECT * FROM transcripts WHERE id < ? ORDER BY id DESC LIMIT ?", (before, limit), limit,
+    )
+
+@app.route("/search")
+def search():
+    q = fts_query(request.args.get("q", ""))
+    if q is None:
+        logger.warning("Search request missing q.")
+        return jsonify({"error": "missing q"}), 400
+
+    limit, before = history_page_args()
+    return history_page(
+        "SELECT t.*, snippet(transcripts_fts, -1, '[', ']', '…', 12) AS snippet "
+        "FROM transcripts_fts JOIN transcripts t ON t.id = transcripts_fts.rowid "
+        "WHERE transcripts_fts MATCH ? AND transcripts_fts.rowid < ? "
+        "ORDER BY transcripts_fts.rowid DESC LIMIT ?",
+        (q, before, limit), limit,
+    )
+
+@app.route("/set_history", methods=["POST"])
+def set_history():
+    data = request.json or {}
+
+    valid = {
+        "enabled": lambda v: isinstance(v, bool),
+        "retention_days": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0,
+        "max_entries": lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 0,
+    }
+    if not data or any(k not in valid or not valid[k](v) for k, v in data.items()):
+        logger.warning(f"Invalid history settings request: {data}")
+        return jsonify({"error": "Invalid history settings"}), 400
+
+    global history_last_maintenance
+    HISTORY_SETTINGS.update(data)
+    history_last_maintenance = 0.0        # apply new limits on the writer's next pass
+    logger.info(f"History settings updated: {data}")
+    return jsonify({"status": "ok"})
+
+# -------------------------------------------------------------------
+# ASYNC SERVING MODE (optional, needs aiohttp)
+# -------------------------------------------------------------------
+# run_async_server() serves the same routes from one asyncio event loop
+# instead of the Werkzeug development server:
+# - /format_text, and /transcribe and /dictate with raw PCM bodies, are
+#   native coroutines. Ollama is called through an aiohttp client and
+#   inference is awaited on the scheduler's Future, so no thread is held
+#   while the LLM or the model works. PCM decoding and VAD run on a small
+#   CPU executor; Whisper itself stays on the inference worker.
+# - Every other route, and multipart uploads, run the Flask app through a
+#   WSGI bridge on a thread pool, so behavior there is unchanged.
+# - Backpressure: more than ASYNC_MAX_INFLIGHT native requests at once get
+#   503 with Retry-After instead of piling up; at most ASYNC_MAX_LLM_CALLS
+#   Ollama calls run concurrently, and a call that cannot get a slot within
+#   ASYNC_LLM_SLOT_TIMEOUT falls back to the unformatted text, like any
+#   other formatting failure. Bodies over ASYNC_MAX_BODY_MB get 413.
+ASYNC_MAX_INFLIGHT = 64
+ASYNC_MAX_LLM_CALLS = 4
+ASYNC_LLM_SLOT_TIMEOUT = 10.0    # seconds
+ASYNC_MAX_BODY_MB = 128          # 30 min of float32 PCM is ~115 MB
+ASYNC_CPU_THREADS = 2
+ASYNC_WSGI_THREADS = 8
+
+web = None                       # aiohttp.web, imported by run_async_server()
+async_inflight = 0
+
+class LLMBusy(Exception):
+    pass
+
+class AsyncLLMClient:
+    """aiohttp counterpart of the ollama_session helpers above."""
+    def __init__(self, session):
+        self.session = session
+        self.slots = asyncio.Semaphore(ASYNC_MAX_LLM_CALLS)
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self.slots.acquire(), ASYNC_LLM_SLOT_TIMEOUT)
+        except asyncio.TimeoutError:
+            metrics.inc("async_rejected_total", reason="llm_slots")
+            raise LLMBusy(f"no LLM slot free within {ASYNC_LLM_SLOT_TIMEOUT:.0f}s")
+
+    async def chat(self, payload):
+        await self.acquire()
+        try:
+            async with self.session.post(f"{OLLAMA_URL}/api/chat", json=payload) as r:
+                r.raise_for_status()
+                data = await r.json(content_type=None)
+                return data.get("message", {}).get("content", "")
+        finally:
+            self.slots.release()
+
+    async def chat_stream(self, payload):
+        await self.acquire()
+        try:
+            async with self.session.post(f"{OLLAMA_URL}/api/chat", json=payload) as r:
+                r.raise_for_status()
+                async for line in r.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    piece = chunk.get("message", {}).get("content", "")
+                    if piece:
+                        yield piece
+        finally:
+            self.slots.release()
+
+    async def format(self, text):
+        """Async format_with_profile."""
+        name, profile = get_active_profile()
+        if not profile.get("enabled", False):
+            return text
+        text, needs_llm = local_format(name, profile, text)
+        if not needs_llm:
+            return text
+
+        key = format_cache_key(name, profile, text)
+        cached = format_cache.get(key)
+        if cached is not None:
+            logger.info(f"Format cache hit (profile={name})")
+            return cached
+
+        start = time.time()
+        try:
+            logger.info(f"Sending format request (profile={name})")
+            formatted = await self.chat(build_chat_payload(profile, text, stream=False))
+        except Exception as e:
+            logger.error(f"Formatting failed: {e}", exc_info=not isinstance(e, LLMBusy))
+            return text
+        finally:
+            metrics.observe("stage_seconds", time.time() - start, stage="llm_format")
+
+        if not formatted:
+            return text
+        format_cache.put(key, formatted)
+        return formatted
+
+    async def format_stream(self, text):
+        """Async stream_with_profile."""
+        name, profile = get_active_profile()
+        if not profile.get("enabled", False):
+            yield text
+            return
+        text, needs_llm = local_format(name, profile, text)
+        if not needs_llm:
+            yield text
+            return
+
+        key = format_cache_key(name, profile, text)
+        cached = format_cache.get(key)
+        if cached is not None:
+            logger.info(f"Format cache hit (profile={name})")
+            yield cached
+            return
+
+        pieces = []
+        start = time.time()
+        try:
+            logger.info(f"Sending streaming format request (profile={name})")
+            async for piece in self.chat_stream(build_chat_payload(profile, text, stream=True)):
+                pieces.append(piece)
+                yield piece
+        except Exception as e:
+            logger.error(f"Streaming formatting failed: {e}", exc_info=not isinstance(e, LLMBusy))
+            if not pieces:
+                yield text
+            return
+        finally:
+            metrics.observe("stage_seconds", time.time() - start, stage="llm_format")
+
+        if pieces:
+            format_cache.put(key, "".join(pieces))
+
+@metrics.gauges
+def collect_async_gauges():
+    if web is not None:
+        yield "async_inflight", "Native async requests being served.", {}, async_inflight
+
+def async_native(route):
+    """Marks a coroutine as a native route; adds the in-flight limit and request metrics."""
+    def wrap(handler):
+        async def wrapper(request):
+            global async_inflight
+            if async_inflight >= ASYNC_MAX_INFLIGHT:
+                metrics.inc("async_rejected_total", reason="inflight")
+                metrics.inc("requests_total", route=route, status=503)
+                return web.json_response({"error": "server busy"}, status=503, headers={"Retry-After": "1"})
+
+            async_inflight += 1
+            trace_id = request.headers.get("X-Trace-Id") or uuid.uuid4().hex[:12]
+            trace_id_var.set(trace_id)
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status
+                if not response.prepared:
+                    response.headers["X-Trace-Id"] = trace_id
+                return response
+            finally:
+                async_inflight -= 1
+                metrics.inc("requests_total", route=route, status=status)
+                metrics.observe("request_seconds", time.perf_counter() - start, route=route)
+        return wrapper
+    return wrap
+
+async def run_cpu(request, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Executor threads do not inherit the request's context (and trace ID)
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(request.app["cpu_executor"], partial(ctx.run, fn, *args, **kwargs))
+
+async def read_async_audio(request, timings):
+    """Raw PCM body -> float32 array; same metrics as read_request_audio()."""
+    start = time.time()
+    raw = await request.read()
+    if not raw:
+        raise ValueError("Missing audio: send raw PCM bytes or a multipart 'file'")
+    received = time.time()
+
+    audio = await run_cpu(
+        request, decode_pcm, raw,
+        dtype=request.query.get("dtype", "float32"),
+        sample_rate=request.query.get("sample_rate", SAMPLE_RATE),
+    )
+    timings["receive"] = received - start
+    timings["decode"] = time.time() - received
+
+    metrics.observe("stage_seconds", timings["receive"], stage="upload_receive")
+    metrics.observe("stage_seconds", timings["decode"], stage="audio_decode")
+    metrics.inc("audio_seconds_total", len(audio) / SAMPLE_RATE)
+    return audio
+
+async def transcribe_async(request, audio, deadline=None):
+    result, job = await run_cpu(
+        request, submit_transcription, audio, group=request.query.get("group"), deadline=deadline,
+    )
+    if job is not None:
+        result["text"] = await asyncio.wrap_future(job)
+    return result
+
+@async_native("/format_text")
+async def async_format_text(request):
+    update_idle_timer()
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    text = data.get("text", "") if isinstance(data, dict) else ""
+
+    if not text:
+        logger.warning("Formatting request missing text.")
+        return web.json_response({"error": "missing text"}, status=400)
+
+    llm = request.app["llm"]
+    if data.get("stream") or request.query.get("stream") == "1":
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/plain; charset=utf-8", "X-Trace-Id": trace_id_var.get(),
+        })
+        await response.prepare(request)
+        async for piece in llm.format_stream(text):
+            await response.write(piece.encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    return web.json_response({"text": await llm.format(text)})
+
+@async_native("/transcribe")
+async def async_transcribe(request):
+    started = time.time()
+    update_idle_timer()
+
+    try:
+        audio = await read_async_audio(request, {})
+    except ValueError as e:
+        logger.warning(f"Bad audio in transcribe request: {e}")
+        return web.json_response({"error": str(e)}, status=400)
+
+    # Same as Flask's args.get(type=float): an unparsable value is ignored
+    try:
+        timeout = float(request.query.get("timeout", ""))
+    except ValueError:
+        timeout = None
+    deadline = time.time() + timeout if timeout else None
+
+    try:
+        logger.info(f"Starting transcription ({len(audio) / SAMPLE_RATE:.1f}s of audio)...")
+        result = await transcribe_async(request, audio, deadline)
+        metrics.observe("stage_seconds", time.time() - started, stage="total")
+        logger.info("Transcription successful.")
+        record_transcript("transcribe", result["text"], audio_seconds=result["audio_seconds"])
+        return web.json_response(result)
+
+    except JobCancelled as e:
+        logger.info(f"Transcription cancelled: {e}")
+        return web.json_response({"error": "cancelled"}, status=409)
+
+    except JobExpired as e:
+        logger.warning(f"Transcription dropped: {e}")
+        return web.json_response({"error": "deadline exceeded"}, status=503)
+
+    except Exception as e:
+        logger.error(f"Transcription failed: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+@async_native("/dictate")
+async def async_dictate(request):
+    started = time.time()
+    update_idle_timer()
+    timings = {}
+
+    try:
+        audio = await read_async_audio(request, timings)
+    except ValueError as e:
+        logger.warning(f"Bad audio in dictate request: {e}")
+        return web.json_response({"error": str(e)}, status=400)
+
+    try:
+        t = time.time()
+        result = await transcribe_async(request, audio)
+        timings["transcribe"] = time.time() - t
+    except JobCancelled as e:
+        logger.info(f"Dictation cancelled: {e}")
+        return web.json_response({"error": "cancelled"}, status=409)
+    except Exception as e:
+        logger.error(f"Dictation transcription failed: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+    # Same payloads as dictation_response()
+    llm = request.app["llm"]
+    raw = result.pop("text")
+    name, _ = get_active_profile()
+    result.update({"raw": raw, "format": name})
+
+    if request.query.get("stream") != "1":
+        t = time.time()
+        result["text"] = await llm.format(raw) if raw else raw
+        timings["format"] = time.time() - t
+        timings["total"] = time.time() - started
+        metrics.observe("stage_seconds", timings["total"], stage="total")
+        result["timings"] = {k: round(v, 4) for k, v in timings.items()}
+        record_transcript("dictate", raw, result["text"], name, result["audio_seconds"])
+        return web.json_response(result)
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson", "X-Trace-Id": trace_id_var.get()})
+    await response.prepare(request)
+    await response.write((json.dumps({"type": "raw", **result}) + "\n").encode("utf-8"))
+
+    t = time.time()
+    pieces = []
+    if raw:
+        async for piece in llm.format_stream(raw):
+            pieces.append(piece)
+            await response.write((json.dumps({"type": "delta", "text": piece}) + "\n").encode("utf-8"))
+    timings["format"] = time.time() - t
+    timings["total"] = time.time() - started
+    metrics.observe("stage_seconds", timings["total"], stage="total")
+    record_transcript("dictate", raw, "".join(pieces), name, result["audio_seconds"])
+
+    await response.write((json.dumps({
+        "type": "done",
+        "text": "".join(pieces),
+        "timings": {k: round(v, 4) for k, v in timings.items()},
+    }) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+def multipart_to_flask(handler):
+    """Multipart uploads keep going through the Flask route (temp file + ffmpeg)."""
+    async def route(request):
+        if request.content_type.startswith("multipart/"):
+            return await wsgi_bridge(request)
+        return await handler(request)
+    return route
+
+async def wsgi_bridge(request):
+    """Runs the Flask app for one request on the WSGI thread pool, streaming its body back."""
+    from werkzeug.test import run_wsgi_app
+
+    body = await request.read()
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string,
+        "SERVER_NAME": request.app["host"],
+        "SERVER_PORT": str(request.app["port"]),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name in set(request.headers.keys()):
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[key] = ",".join(request.headers.getall(name))
+
+    loop = asyncio.get_running_loop()
+    executor = request.app["wsgi_executor"]
+    # One context for the whole response, so the trace ID set by Flask's
+    # before_request is still there while a streamed body is generated
+    ctx = contextvars.copy_context()
+    app_iter, status, headers = await loop.run_in_executor(
+        executor, partial(ctx.run, run_wsgi_app, app.wsgi_app, environ, buffered=False)
+    )
+
+    response = web.StreamResponse(status=int(status.split(" ", 1)[0]))
+    for name, value in headers.items():
+        if name.lower() not in ("content-length", "transfer-encoding", "connection"):
+            response.headers.add(name, value)
+
+    chunks = iter(app_iter)
+    try:
+        await response.prepare(request)
+        while True:
+            chunk = await loop.run_in_executor(executor, ctx.run, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await response.write(chunk)
+        await response.write_eof()
+    finally:
+        close = getattr(app_iter, "close", None)
+        if close is not None:
+            await loop.run_in_executor(executor, ctx.run, close)
+    return response
+
+def create_async_app(host, port):
+    global web
+    from aiohttp import web, ClientSession, ClientTimeout, TCPConnector
+
+    async_app = web.Application(client_max_size=ASYNC_MAX_BODY_MB * 1024 * 1024)
+    async_app["host"], async_app["port"] = host, port
+    async_app["cpu_executor"] = ThreadPoolExecutor(ASYNC_CPU_THREADS, thread_name_prefix="async-cpu")
+    async_app["wsgi_executor"] = ThreadPoolExecutor(ASYNC_WSGI_THREADS, thread_name_prefix="async-wsgi")
+
+    async def open_llm_client(a):
+        session = ClientSession(
+            timeout=ClientTimeout(sock_connect=OLLAMA_CONNECT_TIMEOUT, sock_read=OLLAMA_READ_TIMEOUT),
+            connector=TCPConnector(limit=ASYNC_MAX_LLM_CALLS * 2),
+        )
+        a["llm"] = AsyncLLMClient(session)
+
+    async def close_llm_client(a):
+        await a["llm"].session.close()
+        a["cpu_executor"].shutdown(wait=False)
+        a["wsgi_executor"].shutdown(wait=False)
+
+    async_app.on_startup.append(open_llm_client)
+    async_app.on_cleanup.append(close_llm_client)
+
+    async_app.router.add_post("/format_text", async_format_text)
+    async_app.router.add_post("/transcribe", multipart_to_flask(async_transcribe))
+    async_app.router.add_post("/dictate", multipart_to_flask(async_dictate))
+    async_app.router.add_route("*", "/{tail:.*}", wsgi_bridge)
+    return async_app
+
+def run_async_server(host="127.0.0.1", port=5000):
+    """Blocks serving the app with aiohttp; uses the Flask server if aiohttp is not installed."""
+    try:
+        import aiohttp
+    except ImportError:
+        logger.warning("aiohttp is not installed; falling back to the Flask development server.")
+        app.run(host=host, port=port, debug=False, use_reloader=False)
+        return
+
+    logger.info(f"Starting async server (aiohttp {aiohttp.__version__}) on {host}:{port}")
+    web_app = create_async_app(host, port)
+    web.run_app(web_app, host=host, port=port, handle_signals=False, print=None, access_log=None)
 
 # -------------------------------------------------------------------
 # DEBUG RUN
 # -------------------------------------------------------------------
 if __name__ == "__main__":
-    logger.info("Server running in debug mode.")
-    app.run(host="127.0.0.1", port=5000, debug=True)
+    if "--async" in sys.argv:
+        run_async_server()
+    else:
+        logger.info("Server running in debug mode.")
+        app.run(host="127.0.0.1", port=5000, debug=True)
@@ -6,19 +6,28 @@ import signal
 import threading
 import ctypes
 import ctypes.wintypes as wintypes
-import tempfile
 import logging
+import queue
+import uuid
+import atexit
+import json
+import multiprocessing
 
 import requests
 import numpy as np
 import sounddevice as sd
-import soundfile as sf
 from functools import partial
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import psutil
 
 from PyQt5 import QtWidgets, QtCore, QtWebEngineWidgets, QtGui
 from PyQt5.QtGui import QIcon
 
+# The server's long-form transcription pool spawns worker processes. In a
+# frozen build each worker re-executes this script, so hand it over to
+# multiprocessing before any logging or server setup below runs.
+multiprocessing.freeze_support()
+
 
 # ===================================================================
 # Path Helpers
@@ -32,22 +41,60 @@ def resource_path(relative):
 # ===================================================================
 # Logging
 # ===================================================================
+# Same scheme as server.log: queued writes, size-based rotation, and the
+# current dictation's trace ID on every record. The ID is also sent to the
+# backend as X-Trace-Id, so both logs can be joined on it.
 LOG_DIR = resource_path('logs')
 os.makedirs(LOG_DIR, exist_ok=True)
 
 run_log_path = os.path.join(LOG_DIR, "run.log")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_JSON = False          # JSON lines instead of plain text
+
+dictation_trace_id = "-"
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = dictation_trace_id
+        return True
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }, ensure_ascii=False)
+
 
 logger = logging.getLogger("run")
 logger.setLevel(logging.INFO)
 
-handler = logging.FileHandler(run_log_path, mode="w", encoding="utf-8")
-handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+handler = RotatingFileHandler(
+    run_log_path, mode="a", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8",
+)
+if LOG_JSON:
+    handler.setFormatter(JsonLineFormatter())
+else:
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s"))
 
 if logger.handlers:
     logger.handlers.clear()
 
-logger.addHandler(handler)
-logger.info("run.py started (log overwritten).")
+log_queue = queue.SimpleQueue()
+queue_handler = QueueHandler(log_queue)
+queue_handler.addFilter(TraceIdFilter())
+logger.addHandler(queue_handler)
+
+log_listener = QueueListener(log_queue, handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+logger.info("run.py started.")
 
 
 # ===================================================================
@@ -64,17 +111,50 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 APP_DIR = os.path.join(BASE_DIR, "flask_gui")
 sys.path.append(APP_DIR)
 
-from flask_gui.server import app
+from flask_gui.server import app, run_async_server
+
+# One pooled connection to the backend for every client call
+api = requests.Session()
 
 
 # ===================================================================
 # Flask + Ollama Startup
 # ===================================================================
+# "flask" runs the Werkzeug development server. "async" serves the same
+# routes from an asyncio loop (needs aiohttp; falls back to "flask" without
+# it) so LLM calls don't hold threads and load is bounded.
+SERVER_MODE = "flask"
+
+
 def start_flask():
+    if SERVER_MODE == "async":
+        logger.info("Starting async backend...")
+        run_async_server(host="127.0.0.1", port=5000)
+        return
+
     logger.info("Starting Flask backend...")
     app.run(host="127.0.0.1", port=5000, debug=False, use_reloader=False)
 
 
+def wait_for_server(timeout=15.0):
+    """Polls /ready until the HTTP surface answers instead of sleeping a fixed time."""
+    started = time.time()
+    while time.time() - started < timeout:
+        try:
+            status = api.get("http://127.0.0.1:5000/ready", timeout=0.5).json()
+            if status["stages"]["http_up"]:
+                if not status["stages"]["model_available"]:
+                    logger.warning(f"Selected model {status['model']} was not found in the models folder.")
+                logger.info(f"Backend ready after {time.time() - started:.2f}s.")
+                return True
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+        time.sleep(0.02)
+
+    logger.error(f"Backend did not report ready within {timeout:.0f}s; starting the UI anyway.")
+    return False
+
+
 def start_ollama():
     for proc in psutil.process_iter(attrs=['pid', 'name']):
         if 'ollama' in proc.info['name'].lower():
@@ -83,7 +163,9 @@ def start_ollama():
 
     logger.info("Starting Ollama...")
     ollama_exe = r"C:\Users\Work.LAPTOP-JOMS87TS\AppData\Local\Programs\Ollama\ollama.exe"
-    subprocess.Popen([ollama_exe, "run", "qwen2.5:1.5b-instruct"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Only the server is started; the backend loads whichever model the
+    # selected format profile needs (see "LLM Residency" in server.py).
+    subprocess.Popen([ollama_exe, "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     return True
 
 
@@ -92,17 +174,62 @@ def start_ollama():
 # ===================================================================
 is_recording = False
 stream = None
-buffer = []
 samplerate = 16000
 channels = 1
-
-temp_path = os.path.join(tempfile.gettempdir(), "gammawhisper_temp.wav")
-
-
-def audio_callback(indata, frames, time_info, status):
-    if status:
-        logger.warning(f"Audio callback status: {status}")
-    buffer.append(indata.copy())
+MAX_RECORDING_SECONDS = 30 * 60    # samples past this are dropped
+
+
+class CaptureBuffer:
+    """
+    Float32 sample store written by the audio callback, allocated once for
+    max_seconds so the callback never grows or copies the array; it only
+    copies its own block. The OS commits the pages as they are first
+    written, so a short recording costs only what it uses. Readers get
+    zero-copy views of a region that is never written again.
+    """
+
+    def __init__(self, samplerate, max_seconds):
+        self.data = np.empty(int(samplerate * max_seconds), dtype=np.float32)
+        self.length = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def write(self, block):
+        """block is the callback's (frames, channels) array; channel 0 is kept."""
+        with self.lock:
+            n = min(len(block), len(self.data) - self.length)
+            if n < len(block):
+                self.dropped += len(block) - n
+            if n <= 0:
+                return
+
+            end = self.length + n
+            self.data[self.length:end] = block[:n, 0]
+            self.length = end
+
+    def callback(self, indata, frames, time_info, status):
+        """sounddevice InputStream callback."""
+        if status:
+            logger.warning(f"Audio callback status: {status}")
+        self.write(indata)
+
+    def view(self, start=0):
+        with self.lock:
+            return self.data[start:self.length]
+
+    def __len__(self):
+        return self.length
+
+
+# The recording in progress (or the last one). Each recording gets its own
+# buffer and uploader, so a new recording never touches the samples or
+# session of one that is still being transcribed.
+capture = None
+
+# Incremental transcription: chunks are streamed to a server session while
+# recording so committed windows are transcribed before the user stops.
+STREAM_UPLOAD_INTERVAL = 1.0
+uploader = None
 
 
 def enable_sigint_handler():
@@ -142,7 +269,8 @@ class BubbleWindow(QtWidgets.QWidget):
         self.view.load(QtCore.QUrl("http://127.0.0.1:5000/bubble"))
 
         self.hotkey_trigger.connect(lambda: toggle_action(self))
-        self.copy_to_clipboard.connect(self._copy_text)
+        # Blocking so a paste that follows emit() always sees the new clipboard
+        self.copy_to_clipboard.connect(self._copy_text, QtCore.Qt.BlockingQueuedConnection)
 
         screen = QtWidgets.QApplication.primaryScreen()
         rect = screen.availableGeometry()
@@ -225,35 +353,35 @@ class BubbleWindow(QtWidgets.QWidget):
 
     def fetch_config(self):
         try:
-            return requests.get("http://127.0.0.1:5000/get_config").json()
+            return api.get("http://127.0.0.1:5000/get_config").json()
         except Exception as e:
             logger.error(f"Failed to fetch config: {e}", exc_info=True)
             return {"device": "cpu", "model": "", "models": [], "format": "disable"}
 
     def set_device_request(self, dev):
         try:
-            requests.post("http://127.0.0.1:5000/set_device", json={"device": dev})
+            api.post("http://127.0.0.1:5000/set_device", json={"device": dev})
             logger.info(f"Device changed to {dev}")
         except Exception as e:
             logger.error(f"Failed to set device: {e}", exc_info=True)
 
     def change_model(self, model_name):
         try:
-            requests.post("http://127.0.0.1:5000/set_model", json={"model": model_name})
+            api.post("http://127.0.0.1:5000/set_model", json={"model": model_name})
             logger.info(f"Model changed to {model_name}")
         except Exception as e:
             logger.error(f"Failed to change model: {e}", exc_info=True)
 
     def set_format_request(self, value):
         try:
-            requests.post("http://127.0.0.1:5000/set_format", json={"format": value})
+            api.post("http://127.0.0.1:5000/set_format", json={"format": value})
             logger.info(f"Format mode changed to {value}")
         except Exception as e:
             logger.error(f"Failed to change format: {e}", exc_info=True)
 
     def set_theme_request(self, theme):
         try:
-            requests.post("http://127.0.0.1:5000/set_theme", json={"theme": theme})
+            api.post("http://127.0.0.1:5000/set_theme", json={"theme": theme})
             logger.info(f"Theme set to: {theme}")
             self.view.reload()
         except Exception as e:
@@ -280,14 +408,33 @@ class BubbleWindow(QtWidgets.QWidget):
 # ===================================================================
 # Recording + Transcription
 # ===================================================================
+def trace_headers():
+    return {"X-Trace-Id": dictation_trace_id}
+
+
+def prepare_model():
+    try:
+        api.post("http://127.0.0.1:5000/prepare", headers=trace_headers(), timeout=2)
+    except Exception as e:
+        logger.error(f"Failed to request model warm-up: {e}", exc_info=True)
+
+
 def start_recording(view):
-    global stream, buffer
+    global stream, capture, uploader, dictation_trace_id
+    dictation_trace_id = uuid.uuid4().hex[:12]
+
+    # Load/warm the model in the background while the user is talking
+    threading.Thread(target=prepare_model, daemon=True).start()
 
-    buffer = []
-    stream = sd.InputStream(samplerate=samplerate, channels=channels, callback=audio_callback)
+    capture = CaptureBuffer(samplerate, MAX_RECORDING_SECONDS)
+    stream = sd.InputStream(samplerate=samplerate, channels=channels, dtype="float32", callback=capture.callback)
     stream.start()
     logger.info("Recording started.")
 
+    # Opens the server session on its own thread; the GUI thread never waits
+    uploader = SessionUploader(capture, dictation_trace_id)
+    uploader.start()
+
     view.view.page().runJavaScript(
         'document.getElementById("bubble").classList.add("show");'
         'document.getElementById("status").textContent="Listening";'
@@ -295,6 +442,74 @@ def start_recording(view):
     )
 
 
+def post_pcm(url, audio, trace_id, **kwargs):
+    params = {"dtype": "float32", "sample_rate": samplerate}
+    params.update(kwargs.pop("params", {}))
+    return api.post(
+        url,
+        params=params,
+        # memoryview sends the samples straight from the capture buffer
+        data=memoryview(audio).cast("B") if audio is not None else b"",
+        headers={"Content-Type": "application/octet-stream", "X-Trace-Id": trace_id},
+        **kwargs,
+    )
+
+
+class SessionUploader:
+    """
+    Streams one recording to a server session. All of its state (session
+    id, samples sent) lives on the instance and is only touched by its
+    thread until finish() has joined it.
+    """
+
+    def __init__(self, buffer, trace_id):
+        self.buffer = buffer
+        self.trace_id = trace_id
+        self.session_id = None
+        self.sent = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        try:
+            res = api.post(
+                "http://127.0.0.1:5000/session/open", json={"cancel_stale": True},
+                headers={"X-Trace-Id": self.trace_id}, timeout=2,
+            )
+            self.session_id = res.json()["session"]
+        except Exception as e:
+            logger.error(f"Failed to open transcription session: {e}", exc_info=True)
+            return
+
+        url = f"http://127.0.0.1:5000/session/{self.session_id}/append"
+        while not self.stop.wait(STREAM_UPLOAD_INTERVAL):
+            audio = self.take_new_audio()
+            if audio is None:
+                continue
+            try:
+                post_pcm(url, audio, self.trace_id).raise_for_status()
+            except Exception as e:
+                # Fall back to a one-shot upload of the whole buffer at stop
+                logger.error(f"Session chunk upload failed: {e}", exc_info=True)
+                self.session_id = None
+                return
+
+    def take_new_audio(self):
+        """Zero-copy view of the samples captured since the last upload."""
+        audio = self.buffer.view(self.sent)
+        self.sent += len(audio)
+        return audio if len(audio) else None
+
+    def finish(self):
+        """Stops uploading; returns the session id, or None if the session is unusable."""
+        self.stop.set()
+        self.thread.join()
+        return self.session_id
+
+
 def paste_text():
     user32.keybd_event(0x11, 0, 0, 0)
     user32.keybd_event(0x56, 0, 0, 0)
@@ -303,47 +518,74 @@ def paste_text():
     logger.info("Pasted text via Ctrl+V simulation.")
 
 
-def stop_recording_and_transcribe(view):
-    global stream, buffer
+# Each dictation is pasted with a single clipboard write and Ctrl+V. The
+# keystroke is processed by the target window asynchronously, so changing
+# the clipboard again for a later piece could race it (duplicated or lost
+# text) and would fill the clipboard history. The server can stream the
+# formatted text (stream=1) for other clients; this one asks for the
+# complete reply.
+def deliver_text(view, text):
+    view.copy_to_clipboard.emit(text)   # returns once the clipboard is set
+    paste_text()
+
+
+def consume_dictation(view, res):
+    """Pastes the result of /dictate or a formatting session finalize."""
+    res.raise_for_status()
+    data = res.json()
+    logger.info(f"Dictation timings: {data.get('timings')}")
+    deliver_text(view, data.get("text", ""))
 
-    if stream:
-        stream.stop()
-        stream.close()
-        stream = None
+
+def stop_recording_and_transcribe(view, recording_stream, buffer, upload, trace_id):
+    """
+    Runs on its own thread and only sees the recording it was handed, so a
+    new recording started meanwhile cannot swap the buffer or session.
+    """
+    global dictation_trace_id
+
+    recording_stream.stop()
+    recording_stream.close()
 
     logger.info("Recording stopped.")
+    if buffer.dropped:
+        logger.warning(f"Recording hit the {MAX_RECORDING_SECONDS}s cap; {buffer.dropped} samples dropped.")
 
-    if buffer:
-        audio = np.concatenate(buffer, axis=0)
-        sf.write(temp_path, audio, samplerate)
-        logger.info("Temporary audio file written.")
+    session_id = upload.finish()
 
     view.view.page().runJavaScript(
         'document.getElementById("status").textContent="Transcribing…";'
         "stopWaveform();"
     )
 
+    # One request per dictation: the server transcribes and formats with the
+    # active profile.
+    params = {"format": "1"}
+
     try:
-        if os.path.exists(temp_path):
-            with open(temp_path, "rb") as f:
-                res = requests.post("http://127.0.0.1:5000/transcribe", files={"file": f})
-                text = (res.json() or {}).get("text", "")
+        if len(buffer):
+            res = None
 
-                # Formatting
+            if session_id:
+                # Only the not-yet-uploaded tail goes with the finalize call
                 try:
-                    cfg = requests.get("http://127.0.0.1:5000/get_config").json()
-                    mode = cfg.get("format", "disable")
-
-                    if mode != "disable":
-                        fmt = requests.post("http://127.0.0.1:5000/format_text", json={"text": text})
-                        if fmt.ok:
-                            text = fmt.json().get("text", text)
-
+                    res = post_pcm(
+                        f"http://127.0.0.1:5000/session/{session_id}/finalize",
+                        upload.take_new_audio(), trace_id, params=params,
+                    )
+                    res.raise_for_status()
                 except Exception as e:
-                    logger.error(f"Formatting failed: {e}", exc_info=True)
+                    logger.error(f"Session finalize failed, re-sending full audio: {e}", exc_info=True)
+                    res = None
+
+            if res is None:
+                # Raw float32 PCM straight to the server: no temp WAV, no ffmpeg
+                res = post_pcm(
+                    "http://127.0.0.1:5000/dictate", buffer.view(), trace_id, params=params,
+                )
 
-                view.copy_to_clipboard.emit(text)
-                threading.Thread(target=paste_text, daemon=True).start()
+            with res:
+                consume_dictation(view, res)
 
         view.view.page().runJavaScript('window.postMessage({type:"reset"}, "*");')
 
@@ -352,21 +594,21 @@ def stop_recording_and_transcribe(view):
         view.view.page().runJavaScript('document.getElementById("status").textContent="Error";')
         view.view.page().runJavaScript('window.postMessage({type:"reset"}, "*");')
 
-    finally:
-        try:
-            os.remove(temp_path)
-        except:
-            pass
+    # Later records belong to no dictation, unless a new one has already begun
+    if dictation_trace_id == trace_id:
+        dictation_trace_id = "-"
 
 
 def toggle_action(view):
-    global is_recording
+    global is_recording, stream
     if not is_recording:
         is_recording = True
         start_recording(view)
     else:
         is_recording = False
-        threading.Thread(target=stop_recording_and_transcribe, args=(view,), daemon=True).start()
+        recording = (view, stream, capture, uploader, dictation_trace_id)
+        stream = None
+        threading.Thread(target=stop_recording_and_transcribe, args=recording, daemon=True).start()
 
 
 # ===================================================================
@@ -408,7 +650,7 @@ signal.signal(signal.SIGINT, handle_sigint)
 # ===================================================================
 if __name__ == "__main__":
     threading.Thread(target=start_flask, daemon=True).start()
-    time.sleep(1)
+    wait_for_server()
 
     app_qt = QtWidgets.QApplication(sys.argv)
 
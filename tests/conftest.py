@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# Importing server creates its log, cache and history files; keep them out
+# of the source tree
+os.environ.setdefault("WHISPER_DATA_DIR", tempfile.mkdtemp(prefix="whisper-tests-"))
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+
+# server.py is imported as a top-level module, the same way run.py does;
+# the root is for benchmark's Ollama stand-in
+sys.path.insert(0, os.path.join(ROOT, "flask_gui"))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,116 @@
+import pytest
+
+import server
+
+
+def profile(**changes):
+    raw = {"enabled": True, "model": "qwen2.5:1.5b-instruct", "system_prompt": "Fix punctuation.",
+           "options": {"temperature": 0}}
+    raw.update(changes)
+    return server.compile_profile("p", raw)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "persistent_caches", [])
+    return tmp_path
+
+
+def test_format_key_is_stable():
+    assert server.format_cache_key("p", profile(), "hi") == server.format_cache_key("p", profile(), "hi")
+
+
+@pytest.mark.parametrize("changes", [
+    {"model": "llama3.2:1b"},
+    {"system_prompt": "Fix punctuation and casing."},
+    {"options": {"temperature": 0.2}},
+])
+def test_format_key_changes_with_profile_content(changes):
+    assert server.format_cache_key("p", profile(), "hi") != server.format_cache_key("p", profile(**changes), "hi")
+
+
+def test_format_key_changes_with_text_and_profile_name():
+    key = server.format_cache_key("p", profile(), "hi")
+    assert key != server.format_cache_key("p", profile(), "hi.")
+    assert key != server.format_cache_key("q", profile(), "hi")
+
+
+def test_persistence_round_trip(cache_dir):
+    cache = server.LRUCache("round_trip", 10, ttl=60, persist=True)
+    cache.put("a", "Hello, world.")
+    cache.put("b", {"text": "x", "segments": []})
+    server.flush_caches()
+
+    reloaded = server.LRUCache("round_trip", 10, ttl=60, persist=True)
+    assert reloaded.get("a") == "Hello, world."
+    assert reloaded.get("b") == {"text": "x", "segments": []}
+
+
+def test_persistence_drops_expired_entries(cache_dir, monkeypatch):
+    cache = server.LRUCache("expiring", 10, ttl=60, persist=True)
+    cache.put("a", "old")
+    cache.save()
+
+    now = server.time.time()
+    monkeypatch.setattr(server.time, "time", lambda: now + 120)
+    assert server.LRUCache("expiring", 10, ttl=60, persist=True).get("a") is None
+
+
+def test_unpersisted_cache_writes_nothing(cache_dir):
+    cache = server.LRUCache("memory_only", 10)
+    cache.put("a", "dictated text")
+    server.flush_caches()
+    assert not list(cache_dir.iterdir())
+    assert server.FORMAT_CACHE_PERSIST is False
+    assert server.format_cache.path is None
+
+
+@pytest.fixture
+def model_file(tmp_path, monkeypatch):
+    path = tmp_path / "tiny.en.pt"
+    path.write_bytes(b"weights")
+    monkeypatch.setattr(server, "model_path", str(path))
+    return path
+
+
+def speech(seed=0):
+    return server.np.random.default_rng(seed).standard_normal(server.SAMPLE_RATE).astype(server.np.float32)
+
+
+def test_transcript_key_is_stable(model_file):
+    assert server.transcript_cache_key(speech(), None) == server.transcript_cache_key(speech(), None)
+
+
+def test_transcript_key_changes_with_audio_and_prompt(model_file):
+    key = server.transcript_cache_key(speech(), None)
+    assert key != server.transcript_cache_key(speech(seed=1), None)
+    assert key != server.transcript_cache_key(speech(), "Glossary: Kubernetes.")
+
+
+def test_transcript_key_changes_when_model_file_changes(model_file):
+    key = server.transcript_cache_key(speech(), None)
+    model_file.write_bytes(b"retrained weights")
+    assert server.transcript_cache_key(speech(), None) != key
+
+
+def test_transcript_key_without_model_file_is_uncacheable(model_file):
+    model_file.unlink()
+    assert server.transcript_cache_key(speech(), None) is None
+
+
+@pytest.mark.parametrize("name, value", [
+    ("model_name", "base.en.pt"),
+    ("device", "cuda"),
+    ("model_precision", "int8"),
+    ("decode_mode", "accurate"),
+])
+def test_transcript_key_changes_with_model_and_decoding(model_file, monkeypatch, name, value):
+    key = server.transcript_cache_key(speech(), None)
+    monkeypatch.setattr(server, name, value)
+    assert server.transcript_cache_key(speech(), None) != key
+
+
+def test_transcript_cache_is_memory_only_by_default():
+    assert server.TRANSCRIPT_CACHE_PERSIST is False
+    assert server.transcript_cache.path is None
@@ -0,0 +1,69 @@
+import pytest
+
+import server
+from benchmark import OllamaStandIn
+
+TEXT = "please send the quarterly report to the team by friday"
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    stand_in = OllamaStandIn(0, first_token_delay=0, token_delay=0)
+    monkeypatch.setattr(server, "OLLAMA_URL", stand_in.url)
+    monkeypatch.setattr(server, "format_cache", server.LRUCache("test_format_cache", 100))
+    monkeypatch.setitem(server.format_config["formats"], "test", server.compile_profile("test", {
+        "enabled": True, "model": "stand-in", "system_prompt": "Format this.",
+    }))
+    monkeypatch.setattr(server, "format_mode", "test")
+    yield stand_in
+    stand_in.close()
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def test_pooled_reply(ollama, client):
+    res = client.post("/format_text", json={"text": TEXT})
+    assert res.status_code == 200
+    assert res.get_json()["text"] == TEXT
+    assert ollama.requests == 1
+
+
+def test_pooled_reply_is_cached(ollama, client):
+    client.post("/format_text", json={"text": TEXT})
+    res = client.post("/format_text", json={"text": TEXT})
+    assert res.get_json()["text"] == TEXT
+    assert ollama.requests == 1
+
+
+def test_streamed_reply(ollama, client):
+    res = client.post("/format_text?stream=1", json={"text": TEXT})
+    assert res.status_code == 200
+    assert res.get_data(as_text=True) == TEXT
+    assert server.format_cache.get(server.format_cache_key("test", server.format_config["formats"]["test"], TEXT)) == TEXT
+
+
+def test_timeout_returns_input(ollama, client, monkeypatch):
+    monkeypatch.setattr(server, "OLLAMA_READ_TIMEOUT", 0.2)
+    ollama.first_token_delay = 1.0
+
+    assert client.post("/format_text", json={"text": TEXT}).get_json()["text"] == TEXT
+    assert client.post("/format_text?stream=1", json={"text": TEXT}).get_data(as_text=True) == TEXT
+    assert not server.format_cache.data
+
+
+def test_disconnect_mid_stream_keeps_partial_and_skips_cache(ollama, client):
+    ollama.disconnect_after = 3
+
+    res = client.post("/format_text?stream=1", json={"text": TEXT})
+    assert res.status_code == 200
+    assert res.get_data(as_text=True) == " ".join(TEXT.split()[:3])
+    assert not server.format_cache.data
+
+
+def test_disconnect_before_first_piece_returns_input(ollama, client):
+    ollama.disconnect_after = 0
+
+    assert client.post("/format_text?stream=1", json={"text": TEXT}).get_data(as_text=True) == TEXT
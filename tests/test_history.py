@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh history database; rows are written directly, not through the writer thread."""
+    monkeypatch.setattr(server, "HISTORY_DB", str(tmp_path / "history.sqlite3"))
+    monkeypatch.setattr(server, "history_local", threading.local())
+    monkeypatch.setattr(server, "HISTORY_SETTINGS", dict(server.HISTORY_SETTINGS))
+    conn = server.history_connect()
+    conn.executescript(server.HISTORY_SCHEMA)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def add(conn, *texts, created=None):
+    now = time.time() if created is None else created
+    server.history_write(conn, [(now, "test", t, None, None, "tiny.en.pt", 1.0) for t in texts])
+
+
+def test_history_pages_with_next_before(db, client):
+    add(db, *[f"entry {i}" for i in range(5)])
+
+    first = client.get("/history?limit=2").get_json()
+    assert [r["raw"] for r in first["items"]] == ["entry 4", "entry 3"]
+
+    second = client.get(f"/history?limit=2&before={first['next_before']}").get_json()
+    assert [r["raw"] for r in second["items"]] == ["entry 2", "entry 1"]
+
+    last = client.get(f"/history?limit=2&before={second['next_before']}").get_json()
+    assert [r["raw"] for r in last["items"]] == ["entry 0"]
+    assert last["next_before"] is None
+
+
+def test_search_matches_last_word_as_prefix(db, client):
+    add(db, "send the quarterly report", "quarterly planning notes", "lunch order")
+
+    res = client.get("/search?q=quarterly rep").get_json()
+    assert [r["raw"] for r in res["items"]] == ["send the quarterly report"]
+    assert "[quarterly]" in res["items"][0]["snippet"]
+
+    res = client.get("/search?q=quart").get_json()
+    assert len(res["items"]) == 2
+
+
+def test_search_pages_with_next_before(db, client):
+    add(db, *[f"status update {i}" for i in range(3)], "unrelated")
+
+    first = client.get("/search?q=status&limit=2").get_json()
+    assert [r["raw"] for r in first["items"]] == ["status update 2", "status update 1"]
+    rest = client.get(f"/search?q=status&limit=2&before={first['next_before']}").get_json()
+    assert [r["raw"] for r in rest["items"]] == ["status update 0"]
+
+
+def test_search_quotes_user_text(db, client):
+    add(db, 'she said "hello" OR NOT')
+    res = client.get('/search?q="hello" OR').get_json()
+    assert len(res["items"]) == 1
+
+
+def test_search_without_query_is_rejected(client):
+    assert client.get("/search?q=  ").status_code == 400
+
+
+def test_unreadable_database_returns_503(db, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "HISTORY_DB", str(tmp_path / "missing" / "history.sqlite3"))
+    monkeypatch.setattr(server, "history_local", threading.local())
+
+    for path in ("/history", "/search?q=report"):
+        res = client.get(path)
+        assert res.status_code == 503
+        assert res.get_json() == {"error": "history unavailable"}
+
+
+def test_retention_removes_old_entries(db):
+    server.HISTORY_SETTINGS.update(retention_days=30, max_entries=0)
+    add(db, "old note", created=time.time() - 40 * 86400)
+    add(db, "new note")
+
+    server.history_maintenance(db)
+    assert [r["raw"] for r in db.execute("SELECT raw FROM transcripts")] == ["new note"]
+    # The FTS index follows the table
+    assert db.execute("SELECT count(*) FROM transcripts_fts WHERE transcripts_fts MATCH 'old'").fetchone()[0] == 0
+
+
+def test_max_entries_keeps_newest(db):
+    server.HISTORY_SETTINGS.update(retention_days=0, max_entries=3)
+    add(db, *[f"entry {i}" for i in range(5)])
+
+    server.history_maintenance(db)
+    assert [r["raw"] for r in db.execute("SELECT raw FROM transcripts ORDER BY id")] == ["entry 2", "entry 3", "entry 4"]
+
+
+def test_maintenance_compacts_the_file(db):
+    server.HISTORY_SETTINGS.update(retention_days=0, max_entries=1)
+    add(db, *[("filler text " * 200) + str(i) for i in range(300)])
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    before = db.execute("PRAGMA page_count").fetchone()[0]
+
+    server.history_maintenance(db)
+    assert db.execute("PRAGMA page_count").fetchone()[0] < before / 4
+    assert db.execute("PRAGMA freelist_count").fetchone()[0] == 0
@@ -0,0 +1,50 @@
+import pytest
+
+import server
+
+server.import_inference_libs()
+torch = server.torch
+
+DIMS = dict(n_mels=80, n_audio_ctx=16, n_audio_state=16, n_audio_head=2, n_audio_layer=1,
+            n_vocab=51864, n_text_ctx=8, n_text_state=16, n_text_head=2, n_text_layer=1)
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    from whisper.model import ModelDimensions, Whisper
+    torch.manual_seed(0)
+    path = tmp_path / "small.pt"
+    torch.save({"dims": DIMS, "model_state_dict": Whisper(ModelDimensions(**DIMS)).state_dict()}, path)
+    return str(path)
+
+
+def encode(m):
+    torch.manual_seed(1)
+    return m.encoder(torch.randn(1, 80, 2 * DIMS["n_audio_ctx"]))
+
+
+def test_cache_holds_only_tensors(checkpoint):
+    fresh = server.load_int8_model(checkpoint)
+    saved = torch.load(server.model_cache_file(checkpoint, "int8"), weights_only=True)
+    assert saved["dims"] == DIMS
+
+    cached = server.load_int8_model(checkpoint)
+    assert isinstance(cached.encoder.blocks[0].mlp[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert torch.equal(encode(cached), encode(fresh))
+
+
+def test_pickled_module_cache_is_replaced(checkpoint):
+    cache = server.model_cache_file(checkpoint, "int8")
+    torch.save({"source": server.source_signature(checkpoint), "model": server.load_int8_model(checkpoint)}, cache)
+
+    server.load_int8_model(checkpoint)
+    assert "model" not in torch.load(cache, weights_only=True)
+
+
+def test_worker_loads_cache(checkpoint, monkeypatch):
+    monkeypatch.setattr(server.long_form_worker, "_model", None)
+    monkeypatch.setattr(server.long_form_worker, "_init_error", None)
+    fresh = server.load_int8_model(checkpoint)
+    server.long_form_worker.init_worker(1, None, None, server.model_cache_file(checkpoint, "int8"))
+    assert server.long_form_worker._init_error is None
+    assert torch.equal(encode(server.long_form_worker._model), encode(fresh))
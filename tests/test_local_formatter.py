@@ -0,0 +1,77 @@
+import pytest
+
+import server
+
+RULES = server.compile_rules("test", True)
+
+
+def fmt(text):
+    return server.apply_rules(RULES, text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("um so i think we should ship it", "So I think we should ship it."),
+    ("uh, hello there , how are you ??", "Hello there, how are you?"),
+    ("first point;; second point,, done", "First point; second point, done."),
+    ("yes,sounds good", "Yes, sounds good."),
+    ("call bob. no wait, call alice", "Call bob. No wait, call alice."),
+])
+def test_cleanup(text, expected):
+    assert fmt(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("use a cache i.e. now", "Use a cache i.e. now."),
+    ("i.e. now", "I.e. now."),
+    ("some tools e.g. this one", "Some tools e.g. this one."),
+    ("meet at 9 a.m. tomorrow", "Meet at 9 a.m. tomorrow."),
+    ("apples, pears etc. and more", "Apples, pears etc. and more."),
+])
+def test_abbreviations_are_not_sentence_ends(text, expected):
+    assert fmt(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("open server.py and edit it", "Open server.py and edit it."),
+    ("see the readme.md file", "See the readme.md file."),
+    ("the version is 3.11", "The version is 3.11."),
+])
+def test_file_names(text, expected):
+    assert fmt(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("go to acme.com", "Go to acme.com."),
+    ("open https://acme.com/page?id=3 now", "Open https://acme.com/page?id=3 now."),
+    ("mail me at bob@acme.co.uk", "Mail me at bob@acme.co.uk."),
+    ("it runs on localhost:5000", "It runs on localhost:5000."),
+])
+def test_urls(text, expected):
+    assert fmt(text) == expected
+
+
+def test_replacements_are_whole_phrases():
+    rules = server.compile_rules("test", {"replacements": {"gamma whisper": "GammaWhisper"}})
+    assert server.apply_rules(rules, "try gamma whisper today") == "Try GammaWhisper today."
+    assert server.apply_rules(rules, "gamma whispers") == "Gamma whispers."
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Er, the ER is open.", "The ER is open."),
+    ("Um, check the AH fuse", "Check the AH fuse."),
+    ("so UM is a filler here", "So UM is a filler here."),
+])
+def test_all_caps_fillers_are_kept(text, expected):
+    assert fmt(text) == expected
+
+
+def test_empty_rules_object_means_defaults():
+    profile = server.compile_profile("p", {"enabled": True, "rules": {}})
+    assert profile["model"] is None
+    assert server.apply_rules(profile["rules"], "um hello") == "Hello."
+
+
+def test_rules_false_means_no_rules():
+    assert server.compile_profile("p", {"enabled": True, "rules": False, "model": "m"})["rules"] is None
+    with pytest.raises(ValueError):
+        server.compile_profile("p", {"enabled": True, "rules": False})
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import server
+
+merge = server.merge_segment_texts
+
+
+def test_overlap_is_not_capitalized():
+    assert merge(["Hello there.", "there, general kenobi"]) == "Hello there. general kenobi"
+
+
+def test_segment_after_finished_sentence_is_capitalized():
+    assert merge(["It works.", "then we ship it."]) == "It works. Then we ship it."
+
+
+def test_segment_inside_sentence_keeps_its_case():
+    assert merge(["We tested the", "new build today."]) == "We tested the new build today."
+
+
+def test_repeated_words_across_join_are_dropped():
+    assert merge(["send it to the", "to the team."]) == "Send it to the team."
+
+
+def test_overlap_ignores_case_and_punctuation():
+    assert merge(["the quarterly report.", "Report, and the slides."]) == "The quarterly report. and the slides."
+
+
+def test_overlap_longer_than_three_words_is_kept():
+    text = merge(["one two three four", "one two three four five"])
+    assert text == "One two three four one two three four five"
+
+
+def test_empty_segments_are_skipped():
+    assert merge(["", "hello.", "   ", "world"]) == "Hello. World"
+    assert merge([]) == ""
+
+
+def test_decode_float32():
+    samples = np.array([0.0, 0.5, -1.0], dtype=np.float32)
+    audio = server.decode_pcm(samples.tobytes())
+    assert audio.dtype == np.float32
+    assert np.array_equal(audio, samples)
+    audio[0] = 1.0   # writable copy, not a view of the request body
+
+
+def test_decode_int16_is_scaled():
+    raw = np.array([0, 16384, -32768], dtype=np.int16).tobytes()
+    audio = server.decode_pcm(raw, dtype="int16")
+    assert audio.dtype == np.float32
+    assert np.allclose(audio, [0.0, 0.5, -1.0])
+
+
+@pytest.mark.parametrize("dtype, size", [("int16", 3), ("float32", 6)])
+def test_decode_rejects_partial_samples(dtype, size):
+    with pytest.raises(ValueError):
+        server.decode_pcm(b"\0" * size, dtype=dtype)
+
+
+def test_decode_rejects_other_sample_rates():
+    with pytest.raises(ValueError):
+        server.decode_pcm(b"\0" * 8, sample_rate=44100)
+
+
+def test_decode_rejects_unknown_dtype():
+    with pytest.raises(ValueError):
+        server.decode_pcm(b"\0" * 8, dtype="float64")
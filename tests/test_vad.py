@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import server
+
+SR = server.SAMPLE_RATE
+
+
+def noisy_silence(seconds, db=-60, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal(int(seconds * SR)) * 10 ** (db / 20)).astype(np.float32)
+
+
+def tone(seconds, amplitude=0.1, freq=220.0):
+    t = np.arange(int(seconds * SR)) / SR
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+@pytest.mark.parametrize("total, burst", [(20, 0.8), (60, 2.0), (15, 0.5)])
+def test_short_burst_in_long_silence_is_kept(total, burst):
+    audio = noisy_silence(total)
+    start = int(total / 2 * SR)
+    audio[start:start + int(burst * SR)] += tone(burst)
+
+    trimmed, removed = server.trim_silence(audio)
+
+    assert len(trimmed) / SR >= burst
+    assert removed < total - burst
+
+
+def test_silence_is_dropped():
+    trimmed, removed = server.trim_silence(noisy_silence(20))
+    assert len(trimmed) == 0
+    assert removed == pytest.approx(20.0)
+
+
+def test_click_shorter_than_min_speech_is_dropped():
+    audio = noisy_silence(10)
+    audio[SR:SR + int(0.05 * SR)] += tone(0.05)
+    assert server.detect_speech(audio) == []